@@ -13,9 +13,9 @@ from .linking import HashTable, TreeFinder, Point, PointND, \
            SubnetOversizeException, link, link_df, link_iter, \
            link_df_iter, strip_diagnostics
 from .filtering import filter_stubs, filter_clusters, filter
-from .feature import locate, batch, percentile_threshold, local_maxima, \
-           refine, estimate_mass, estimate_size
-from .preprocessing import bandpass
+from .feature import locate, batch, Locator, percentile_threshold, \
+           local_maxima, refine, estimate_mass, estimate_size
+from .preprocessing import bandpass, set_fft_backend
 from .framewise_data import FramewiseData, PandasHDFStore, PandasHDFStoreBig, \
            PandasHDFStoreSingleNode
 from . import utils
@@ -20,8 +20,12 @@ def performance_report():
 
     if preprocessing.USING_FFTW:
         print("FAST: Using pyfftw for image preprocessing.")
+    elif preprocessing.FFT_BACKEND == 'scipy':
+        print("FAST: Using scipy.fft for image preprocessing. (pyfftw may be "
+              "faster.)")
     else:
-        print("SLOW: pyfftw not found (slower image preprocessing).")
+        print("SLOW: pyfftw and scipy.fft not found (slower image "
+              "preprocessing).")
 
 
 def dependencies():
@@ -1,16 +1,25 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
+import sys
 import warnings
+import itertools
+import functools
+import multiprocessing
+import threading
+import time
+from collections import deque
 
 import numpy as np
 import pandas as pd
 from scipy import ndimage
 from scipy.spatial import cKDTree
+from numpy.lib.stride_tricks import as_strided
 from pandas import DataFrame
 
-from . import uncertainty
-from .preprocessing import bandpass, scale_to_gamut
+from . import uncertainty, preprocessing
+from .preprocessing import (bandpass, scale_to_gamut, gaussian_method,
+                            _bandpass, _float_dtype, _fourier_gaussian_kernel)
 from .utils import record_meta, print_update, validate_tuple
 from .masks import binary_mask, r_squared_mask, cosmask, sinmask
 import trackpy  # to get trackpy.__version__
@@ -18,16 +27,62 @@ import trackpy  # to get trackpy.__version__
 from .try_numba import try_numba_autojit, NUMBA_AVAILABLE
 
 
+# Integer images whose values span fewer than this many gray levels are
+# thresholded using a histogram instead of sorting the pixels.
+MAX_HISTOGRAM_BINS = 2**20
+
+# Masks with more pixels than this are dilated using _separable_maxima when
+# local_maxima is called with dilation='auto'.
+SEPARABLE_DILATION_MIN_SIZE = 60
+
+
 def percentile_threshold(image, percentile):
     """Find grayscale threshold based on distribution in image."""
 
+    if np.issubdtype(image.dtype, np.integer) and image.size > 0:
+        lo, hi = int(image.min()), int(image.max())
+        if hi - lo < MAX_HISTOGRAM_BINS:
+            return _histogram_percentile(image, percentile, lo, hi)
     not_black = image[np.nonzero(image)]
     if len(not_black) == 0:
         return np.nan
     return np.percentile(not_black, percentile)
 
 
-def local_maxima(image, radius, percentile=64, margin=None):
+def _histogram_percentile(image, percentile, lo, hi):
+    """Percentile of the nonzero pixels of an integer image, like
+    np.percentile (with linear interpolation), using a histogram.
+
+    This takes one pass over the image and avoids copying it.
+    lo and hi are the minimum and maximum values in the image.
+    """
+    if not 0 <= percentile <= 100:
+        raise ValueError("percentile must be in the range [0, 100]")
+    flat = np.ravel(image)
+    counts = np.zeros(hi - lo + 1, dtype=np.int64)
+    chunksize = 2**20  # bounds the size of temporary arrays
+    for start in range(0, flat.size, chunksize):
+        values = flat[start:start + chunksize].astype(np.intp)
+        if lo != 0:
+            values -= lo
+        counts += np.bincount(values, minlength=len(counts))
+    if lo <= 0 <= hi:
+        counts[-lo] = 0  # Exclude black pixels.
+    cumulative = np.cumsum(counts)
+    count = cumulative[-1]
+    if count == 0:
+        return np.nan
+    # Find the sorted values that bracket the percentile, and interpolate.
+    position = percentile / 100. * (count - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, count - 1)
+    lower_value, upper_value = lo + np.searchsorted(cumulative,
+                                                    [lower, upper], 'right')
+    return lower_value + (upper_value - lower_value) * (position - lower)
+
+
+def local_maxima(image, radius, percentile=64, margin=None,
+                 dilation='auto', threshold=None):
     """Find local maxima whose brightness is above a given percentile.
 
     Parameters
@@ -36,13 +91,26 @@ def local_maxima(image, radius, percentile=64, margin=None):
     percentile : chooses minimum grayscale value for a local maximum
     margin : zone of exclusion at edges of image. Defaults to radius.
             A smarter value is set by locate().
+    dilation : {'auto', 'ndimage', 'separable'}
+        How to compare each pixel with its neighborhood. 'ndimage' performs
+        a grey dilation with the elliptical mask, at a cost proportional
+        to the mask area (or volume) per pixel. 'separable' first applies
+        cheap one-dimensional maximum filters, whose cost does not depend
+        on the radius, and then checks the surviving candidates against
+        the exact elliptical mask. Both give identical results. 'auto'
+        uses 'separable' for large masks.
+    threshold : number, optional
+        Minimum grayscale value for a local maximum, used instead of the
+        percentile of this image, for example to apply the threshold of a
+        whole image to a part of it.
     """
     if margin is None:
         margin = radius
 
     ndim = image.ndim
     # Compute a threshold based on percentile.
-    threshold = percentile_threshold(image, percentile)
+    if threshold is None:
+        threshold = percentile_threshold(image, percentile)
     if np.isnan(threshold):
         warnings.warn("Image is completely black.", UserWarning)
         return np.empty((0, ndim))
@@ -51,9 +119,22 @@ def local_maxima(image, radius, percentile=64, margin=None):
     if not np.issubdtype(image.dtype, np.integer):
         raise TypeError("Perform dilation on exact (i.e., integer) data.")
     footprint = binary_mask(radius, ndim)
-    dilation = ndimage.grey_dilation(image, footprint=footprint,
-                                     mode='constant')
-    maxima = np.vstack(np.where((image == dilation) & (image > threshold))).T
+    if dilation == 'auto':
+        if footprint.sum() > SEPARABLE_DILATION_MIN_SIZE:
+            dilation = 'separable'
+        else:
+            dilation = 'ndimage'
+    if dilation == 'ndimage':
+        dilation = ndimage.grey_dilation(image, footprint=footprint,
+                                         mode='constant')
+        maxima = np.vstack(np.where((image == dilation) &
+                                    (image > threshold))).T
+    elif dilation == 'separable':
+        maxima = _separable_maxima(image, validate_tuple(radius, ndim),
+                                   threshold)
+    else:
+        raise ValueError("Available dilations are 'auto', 'ndimage' and "
+                         "'separable'")
     if not np.size(maxima) > 0:
         warnings.warn("Image contains no local maxima.", UserWarning)
         return np.empty((0, ndim))
@@ -70,6 +151,52 @@ def local_maxima(image, radius, percentile=64, margin=None):
     return maxima
 
 
+def _separable_maxima(image, radius, threshold):
+    """Find the pixels brighter than threshold that are equal to the maximum
+    of their elliptical neighborhood, like the grey dilation in local_maxima.
+
+    Candidates must be maxima of the largest box inscribed in the ellipse
+    and of the lines along each axis through their center, which is checked
+    with one-dimensional maximum filters. Only those candidates are then
+    compared with their full elliptical neighborhood.
+    """
+    ndim = image.ndim
+    box_radius = [int(r / np.sqrt(ndim)) for r in radius]
+    settings = dict(mode='constant', cval=0)
+    candidates = image > threshold
+    for axis in range(ndim):
+        line_max = ndimage.maximum_filter1d(image, 2*radius[axis] + 1, axis,
+                                            **settings)
+        candidates &= image == line_max
+    if any(box_radius):
+        box_max = image
+        for axis in range(ndim):
+            box_max = ndimage.maximum_filter1d(box_max, 2*box_radius[axis] + 1,
+                                               axis, **settings)
+        candidates &= image == box_max
+    coords = np.vstack(np.where(candidates)).T
+
+    # Check the candidates against their elliptical neighborhoods. Pad the
+    # image with zeros (as in mode='constant') only if some need it.
+    radius = np.array(radius)
+    shape = np.array(image.shape)
+    if np.any((coords < radius) | (coords >= shape - radius)):
+        image = np.pad(image, [(r, r) for r in radius], mode='constant')
+        padded_coords = coords + radius
+    else:
+        padded_coords = coords
+    footprint = binary_mask(tuple(radius), ndim).ravel()
+    is_max = np.empty(len(coords), dtype=np.bool_)
+    chunksize = max(1, 2**22 // footprint.size)  # bound memory use
+    for start in range(0, len(coords), chunksize):
+        stop = min(start + chunksize, len(coords))
+        chunk = padded_coords[start:stop]
+        neighborhoods = _neighborhoods(image, radius, chunk)
+        flat = neighborhoods.reshape(stop - start, -1)[:, footprint]
+        is_max[start:stop] = image[tuple(chunk.T)] == flat.max(1)
+    return coords[is_max]
+
+
 def estimate_mass(image, radius, coord):
     "Compute the total brightness in the neighborhood of a local maximum."
     square = [slice(c - rad, c + rad + 1) for c, rad in zip(coord, radius)]
@@ -86,6 +213,64 @@ def estimate_size(image, radius, coord, estimated_mass):
     return Rg
 
 
+def _estimate_mass_and_size(image, radius, coords, size=True):
+    """Compute estimate_mass and, optionally, estimate_size for many coords.
+
+    Parameters
+    ----------
+    image : ndarray
+    radius : tuple of integers
+    coords : integer array of shape (N, image.ndim)
+    size : boolean
+        If False, skip the size estimate and return None in its place.
+
+    Returns
+    -------
+    mass, size : arrays of length N
+    """
+    ndim = image.ndim
+    mask = binary_mask(radius, ndim).ravel()
+    r2 = r_squared_mask(radius, ndim).ravel()[mask]
+    N = len(coords)
+    mass = np.empty(N, dtype=np.float64)
+    Rg = np.empty(N, dtype=np.float64) if size else None
+    # Work in chunks, to bound the memory used by the neighborhoods.
+    chunksize = max(1, 2**22 // mask.size)
+    for start in range(0, N, chunksize):
+        stop = min(start + chunksize, N)
+        neighborhoods = _neighborhoods(image, radius, coords[start:stop])
+        flat = neighborhoods.reshape(stop - start, -1)[:, mask]
+        mass[start:stop] = flat.sum(1)
+        if size:
+            Rg[start:stop] = np.sqrt(flat.dot(r2) / mass[start:stop])
+    return mass, Rg
+
+
+def _neighborhoods(image, radius, coords):
+    """Extract the square neighborhood around each of many coordinates.
+
+    Parameters
+    ----------
+    image : ndarray
+    radius : tuple of integers
+    coords : integer array of shape (N, image.ndim)
+        Every coordinate must be at least radius away from the edges.
+
+    Returns
+    -------
+    ndarray of shape (N, 2*radius[0] + 1, 2*radius[1] + 1, ...)
+        a copy, in the dtype of image
+    """
+    image = np.asarray(image)
+    window_shape = tuple([2*r + 1 for r in radius])
+    # A view of image in which [i, j, ...] is the window starting at (i, j)
+    view_shape = tuple([s - w + 1 for s, w in
+                        zip(image.shape, window_shape)]) + window_shape
+    windows = as_strided(image, view_shape, image.strides * 2)
+    origins = np.asarray(coords, dtype=np.intp) - np.asarray(radius)
+    return windows[tuple(origins.T)]
+
+
 def _safe_center_of_mass(x, radius, grids):
     normalizer = x.sum()
     if normalizer == 0:  # avoid divide-by-zero errors
@@ -95,7 +280,7 @@ def _safe_center_of_mass(x, radius, grids):
 
 
 def refine(raw_image, image, radius, coords, separation=0, max_iterations=10,
-           engine='auto', characterize=True, walkthrough=False):
+           engine='auto', characterize=True, walkthrough=False, stats=None):
     """Find the center of mass of a bright feature starting from an estimate.
 
     Characterize the neighborhood of a local maximum, and iteratively
@@ -116,8 +301,18 @@ def refine(raw_image, image, radius, coords, separation=0, max_iterations=10,
         Compute and return mass, size, eccentricity, signal.
     walkthrough : boolean, False by default
         Print the offset on each loop and display final neighborhood image.
-    engine : {'python', 'numba'}
-        Numba is faster if available, but it cannot do walkthrough.
+    engine : {'python', 'numba', 'vectorized'}
+        Numba is faster if available, but it cannot do walkthrough. It also
+        stops refining once the center is within half a pixel, without the
+        subpixel interpolation step of the other engines, so its positions
+        may differ from theirs by a small fraction of a pixel.
+        'vectorized' refines all features at once using numpy. It is much
+        faster than 'python' for images with many features, and it does not
+        require numba; it cannot do walkthrough either.
+    stats : dict, optional
+        If given, the 'vectorized' engine stores the number of iterations
+        of each feature in stats['iterations'], for profiling. Features
+        that took max_iterations may not have converged.
     """
     # ensure that radius is tuple of integers, for direct calls to refine()
     radius = validate_tuple(radius, image.ndim)
@@ -131,75 +326,112 @@ def refine(raw_image, image, radius, coords, separation=0, max_iterations=10,
         coords = np.array(coords)  # a copy, will not modify in place
         results = _refine(raw_image, image, radius, coords, max_iterations,
                           characterize, walkthrough)
+    elif engine == 'vectorized':
+        if walkthrough:
+            raise ValueError("walkthrough is not available in the vectorized "
+                             "engine")
+        coords = np.array(coords, dtype=np.intp)
+        results = _refine_vectorized(raw_image, image, radius, coords,
+                                     max_iterations, characterize, stats)
     elif engine == 'numba':
         if not NUMBA_AVAILABLE:
             warnings.warn("numba could not be imported. Without it, the "
                           "'numba' engine runs very slow. Use the 'python' "
                           "engine or install numba.", UserWarning)
-        if image.ndim != 2:
-            raise NotImplementedError("The numba engine only supports 2D "
-                                      "images. You can extend it if you feel "
-                                      "like a hero.")
-        if radius[0] != radius[1]:
-            raise NotImplementedError("The numba engine does not support "
-                                      "anisotropic feature finding. "
-                                      "You can extend it if you feel "
-                                      "like a hero.")
         if walkthrough:
-            raise ValueError("walkthrough is not availabe in the numba engine")
+            raise ValueError("walkthrough is not available in the numba engine")
         # Do some extra prep in pure Python that can't be done in numba.
-        coords = np.array(coords, dtype=np.float64)
+        # The compiled function works on flattened images, so it handles
+        # any number of dimensions. The mask is described by the positions
+        # of its pixels, as coordinates and as offsets into the flat image.
+        raw_image = np.ascontiguousarray(raw_image)
+        image = np.ascontiguousarray(image)
+        ndim = image.ndim
+        coords = np.round(np.array(coords, dtype=np.float64)).astype(np.int64)
         N = coords.shape[0]
-        shape = np.array(image.shape, dtype=np.int16)  # array, not tuple
-        mask = binary_mask(radius[0], image.ndim)
-        r2_mask = r_squared_mask(radius[0], image.ndim)
-        cmask = cosmask(radius[0])
-        smask = sinmask(radius[0])
+        shape = np.array(image.shape, dtype=np.int64)  # array, not tuple
+        strides = np.array(image.strides, dtype=np.int64) // image.itemsize
+        radius_ = np.array(radius, dtype=np.int64)
+        mask = binary_mask(radius, ndim)
+        mask_coords = np.ascontiguousarray(np.transpose(np.nonzero(mask)),
+                                           dtype=np.int64)
+        mask_offsets = mask_coords.dot(strides)
+        r2_mask = r_squared_mask(radius, ndim)[mask].astype(np.float64)
+        # I only know how to measure eccentricity in 2D.
+        measure_ecc = ndim == 2 and radius[0] == radius[1]
+        if measure_ecc:
+            cmask = cosmask(radius[0])[mask]
+            smask = sinmask(radius[0])[mask]
+        else:
+            cmask = smask = np.zeros(len(mask_offsets), dtype=np.float64)
         # Allocate a results array that _numba_refine will write to
         if characterize:
-            results_columns = 6
+            results_columns = ndim + 4
         else:
-            results_columns = 3  # Position and mass only
+            results_columns = ndim + 1  # Position and mass only
         results = np.empty((N, results_columns), dtype=np.float64)
-        _ = _numba_refine(np.asarray(raw_image), np.asarray(image), int(radius[0]),
-                                coords, N,
-                                int(max_iterations), characterize,
-                                shape, mask, r2_mask, cmask, smask, results,
-                                np.empty(2, dtype=np.float64),  # Buffer arrays.
-                                np.empty(2, dtype=np.float64),  # See function def.
-                                np.empty(2, dtype=np.float64),
-                                np.empty(2, dtype=np.float64),
-                                np.empty(2, dtype=np.int64),)
+        _ = _numba_refine(raw_image.ravel(), image.ravel(), radius_,
+                          coords, N, int(max_iterations), characterize,
+                          shape, strides, mask_coords, mask_offsets,
+                          int(radius_.dot(strides)), r2_mask, cmask, smask,
+                          results,
+                          np.empty(ndim, dtype=np.int64),  # Buffer arrays.
+                          np.empty(ndim, dtype=np.float64),  # See function def.
+                          np.empty(ndim, dtype=np.float64),
+                          np.empty(ndim, dtype=np.float64),
+                          np.empty(ndim, dtype=np.int64),)
+        if characterize and not measure_ecc:
+            results[:, ndim + 2] = np.nan
     else:
-        raise ValueError("Available engines are 'python' and 'numba'")
+        raise ValueError("Available engines are 'python', 'numba' and "
+                         "'vectorized'")
+
+    return _remove_duplicates(results, separation, image.ndim)
 
+
+def _remove_duplicates(results, separation, ndim):
+    """Remove the dimmer of features closer than separation, from an
+    array of refine results."""
     # Flat peaks return multiple nearby maxima. Eliminate duplicates.
     if np.all(np.greater(separation, 0)):
-        mass_index = image.ndim  # i.e., index of the 'mass' column
-        while True:
-            # Rescale positions, so that pairs are identified below a distance
-            # of 1. Do so every iteration (room for improvement?)
-            positions = results[:, :mass_index]/list(reversed(separation))
-            mass = results[:, mass_index]
-            duplicates = cKDTree(positions, 30).query_pairs(1)
-            if len(duplicates) == 0:
-                break
-            to_drop = []
-            for pair in duplicates:
-                # Drop the dimmer one.
-                if np.equal(*mass.take(pair, 0)):
-                    # Rare corner case: a tie!
-                    # Break ties by sorting by sum of coordinates, to avoid
-                    # any randomness resulting from cKDTree returning a set.
-                    dimmer = np.argsort(np.sum(positions.take(pair, 0), 1))[0]
-                else:
-                    dimmer = np.argmin(mass.take(pair, 0))
-                to_drop.append(pair[dimmer])
-            results = np.delete(results, to_drop, 0)
-
+        mass_index = ndim  # i.e., index of the 'mass' column
+        # Rescale positions, so that pairs are identified below a distance
+        # of 1.
+        positions = results[:, :mass_index]/list(reversed(separation))
+        mass = results[:, mass_index]
+        results = np.delete(results, _find_duplicates(positions, mass), 0)
     return results
 
 
+def _find_duplicates(positions, mass):
+    """Find features that duplicate a brighter feature.
+
+    Parameters
+    ----------
+    positions : ndarray, rescaled so that duplicates are closer than 1
+    mass : ndarray
+
+    Returns
+    -------
+    sorted array of indices of the dimmer feature of each duplicate pair
+    """
+    duplicates = cKDTree(positions, 30).query_pairs(1)
+    if len(duplicates) == 0:
+        return np.empty(0, dtype=np.intp)
+    # Rank features by mass. Break ties by sum of coordinates
+    # (and then by order), to avoid any randomness resulting from
+    # cKDTree returning a set.
+    rank = np.empty(len(mass), dtype=np.intp)
+    rank[np.lexsort((positions.sum(1), mass))] = np.arange(len(mass))
+    # Drop the dimmer one of each pair. Because the ranking is a
+    # strict order, no pairs remain among the survivors, so a single
+    # pass is equivalent to repeating this until no pairs are left.
+    pairs = np.array(list(duplicates), dtype=np.intp)
+    dimmer = np.where(rank[pairs[:, 0]] < rank[pairs[:, 1]],
+                      pairs[:, 0], pairs[:, 1])
+    return np.unique(dimmer)
+
+
 # (This is pure Python. A numba variant follows below.)
 def _refine(raw_image, image, radius, coords, max_iterations,
             characterize, walkthrough):
@@ -294,44 +526,231 @@ def _refine(raw_image, image, radius, coords, max_iterations,
     return result
 
 
-@try_numba_autojit(nopython=False)
+def _refine_vectorized(raw_image, image, radius, coords, max_iterations,
+                       characterize, stats=None):
+    """Refine all features at once; equivalent to _refine.
+
+    Each iteration operates on a stack of neighborhoods, one per feature,
+    and features drop out of the working set as they converge. Subpixel
+    shifts of all the features are interpolated together.
+
+    If stats is a dict, the number of iterations of each feature is stored
+    in stats['iterations'].
+    """
+    SHIFT_THRESH = 0.6
+    GOOD_ENOUGH_THRESH = 0.005
+
+    ndim = image.ndim
+    radius = np.array(radius)
+    mask = binary_mask(tuple(radius), ndim)
+    upper_bound = np.array(image.shape) - 1 - radius
+    # Pixel coordinates in the neighborhood, for computing centers of mass
+    grid = np.indices(mask.shape).reshape(ndim, -1).T.astype(np.float64)
+
+    N = coords.shape[0]
+    rect_coords = coords.copy()  # integer positions of the neighborhoods
+    coord = coords.astype(np.float64)
+    neighborhoods = mask*_neighborhoods(image, radius, rect_coords)
+    cm_n = _vectorized_center_of_mass(neighborhoods, radius, grid)
+    allow_moves = np.ones(N, dtype=np.bool_)
+    active = np.arange(N)
+    iterations = np.zeros(N, dtype=np.intp)
+
+    for iteration in range(max_iterations):
+        off_center = cm_n[active] - radius
+        converged = np.all(np.abs(off_center) < GOOD_ENOUGH_THRESH, 1)
+        active = active[~converged]
+        off_center = off_center[~converged]
+        if active.size == 0:
+            break  # Accurate enough.
+        iterations[active] += 1
+
+        # If we're off by more than half a pixel in any direction, move.
+        move = (np.any(np.abs(off_center) > SHIFT_THRESH, 1) &
+                allow_moves[active])
+        to_move = active[move]
+        if to_move.size > 0:
+            # In here, coord is an integer.
+            oc = off_center[move]
+            new_coord = (rect_coords[to_move] + (oc > SHIFT_THRESH) -
+                         (oc < -SHIFT_THRESH))
+            # Don't move outside the image!
+            new_coord = np.clip(new_coord, radius, upper_bound)
+            rect_coords[to_move] = new_coord
+            coord[to_move] = new_coord
+            neighborhoods[to_move] = mask*_neighborhoods(image, radius,
+                                                         new_coord)
+
+        # If we're off by less than half a pixel, interpolate.
+        to_shift = active[~move]
+        if to_shift.size > 0:
+            oc = off_center[~move]
+            neighborhoods[to_shift] = _shift_neighborhoods(
+                neighborhoods[to_shift], oc)
+            coord[to_shift] += oc
+            # Disallow any whole-pixels moves on future iterations.
+            allow_moves[to_shift] = False
+
+        cm_n[active] = _vectorized_center_of_mass(neighborhoods[active],
+                                                  radius, grid)
+
+    if stats is not None:
+        stats['iterations'] = iterations
+
+    cm_i = cm_n - radius + coord  # image coords
+    # matplotlib and ndimage have opposite conventions for xy <-> yx.
+    final_coords = cm_i[:, ::-1]
+
+    # Characterize the neighborhood of our final centroid.
+    flat = neighborhoods.reshape(N, -1)
+    mass = flat.sum(1).astype(np.float64)
+    if not characterize:
+        return np.column_stack([final_coords, mass])
+    Rg = np.sqrt(flat.dot(r_squared_mask(tuple(radius), ndim).ravel()) / mass)
+    # I only know how to measure eccentricity in 2D.
+    if ndim == 2 and radius[0] == radius[1]:
+        rad = radius[0]
+        ecc = np.sqrt(flat.dot(cosmask(rad).ravel())**2 +
+                      flat.dot(sinmask(rad).ravel())**2)
+        ecc /= (mass - neighborhoods[:, rad, rad] + 1e-6)
+    else:
+        ecc = np.empty(N)
+        ecc.fill(np.nan)
+    raw_neighborhoods = mask*_neighborhoods(raw_image, radius, rect_coords)
+    # black_level subtracted later
+    signal = raw_neighborhoods.reshape(N, -1).max(1)
+    return np.column_stack([final_coords, mass, Rg, ecc, signal])
+
+
+def _shift_neighborhoods(neighborhoods, offsets):
+    """Shift each of a stack of neighborhoods by minus its offset.
+
+    This is equivalent to
+    ndimage.shift(neighborhood, -offset, order=2, mode='constant', cval=0)
+    for each neighborhood, including the rounding to an integer dtype, but
+    all neighborhoods are interpolated at once.
+
+    Parameters
+    ----------
+    neighborhoods : ndarray of shape (N, ...)
+    offsets : ndarray of shape (N, neighborhoods.ndim - 1)
+
+    Returns
+    -------
+    ndarray like neighborhoods
+    """
+    N = neighborhoods.shape[0]
+    ndim = neighborhoods.ndim - 1
+    rows = np.arange(N)[:, np.newaxis]
+    # Quadratic spline coefficients, with a mirrored boundary as ndimage
+    # uses for mode 'constant'. (The stack axis is not filtered.)
+    result = neighborhoods.astype(np.float64)
+    for axis in range(1, ndim + 1):
+        result = ndimage.spline_filter1d(result, 2, axis)
+    # The spline is separable: interpolate along each axis in turn. Along
+    # an axis, every feature has one offset, so three weights.
+    for axis in range(1, ndim + 1):
+        size = result.shape[axis]
+        offset = offsets[:, axis - 1]
+        nearest = np.floor(offset + 0.5)
+        t = (offset - nearest)[(slice(None), np.newaxis) +
+                               (np.newaxis,)*(ndim - 1)]
+        weights = [0.5*(0.5 - t)**2, 0.75 - t**2, 0.5*(0.5 + t)**2]
+        base = np.arange(size) + nearest.astype(np.intp)[:, np.newaxis]
+        # Work along axis 1, indexing (feature, position along axis).
+        coefficients = np.swapaxes(result, 1, axis)
+        shifted = np.zeros_like(coefficients)
+        for step, weight in zip([-1, 0, 1], weights):
+            shifted += weight*coefficients[rows,
+                                           _mirror_index(base + step, size)]
+        # Positions that fall outside the neighborhood are set to zero.
+        position = np.arange(size) + offset[:, np.newaxis]
+        shifted[(position < 0) | (position > size - 1)] = 0
+        result = np.swapaxes(shifted, 1, axis)
+
+    dtype = neighborhoods.dtype
+    if np.issubdtype(dtype, np.integer):
+        # Round half away from zero and clip, as ndimage does.
+        result = np.where(result > 0, result + 0.5, result - 0.5)
+        info = np.iinfo(dtype)
+        result = np.clip(result, info.min, info.max)
+    return result.astype(dtype)
+
+
+def _mirror_index(index, size):
+    """Map indices into range(size), mirroring at the edges (without
+    repeating the edge values)."""
+    if size == 1:
+        return np.zeros_like(index)
+    period = 2*(size - 1)
+    index = np.abs(index) % period
+    return np.where(index >= size, period - index, index)
+
+
+def _vectorized_center_of_mass(neighborhoods, radius, grid):
+    """Center of mass of each of a stack of neighborhoods.
+
+    Like _safe_center_of_mass, an empty neighborhood has its center at
+    radius.
+    """
+    flat = neighborhoods.reshape(neighborhoods.shape[0], -1)
+    normalizer = flat.sum(1).astype(np.float64)
+    empty = normalizer == 0  # avoid divide-by-zero errors
+    normalizer[empty] = 1
+    cm = flat.dot(grid) / normalizer[:, np.newaxis]
+    cm[empty] = radius
+    return cm
+
+
+@try_numba_autojit(nopython=True)
 def _numba_refine(raw_image, image, radius, coords, N, max_iterations,
-                  characterize, shape, mask, r2_mask, cmask, smask, results,
+                  characterize, shape, strides, mask_coords, mask_offsets,
+                  center_offset, r2_mask, cmask, smask, results,
                   coord, cm_n, cm_i, off_center, new_coord):
+    """Refine features in an image of any dimension.
+
+    raw_image and image are flattened (C order); strides converts
+    coordinates to flat indices. The mask is given by the coordinates
+    (mask_coords) and flat offsets (mask_offsets) of its pixels, relative
+    to the corner of the neighborhood, and the mask-like arrays (r2_mask,
+    cmask, smask) are given as values at those pixels. Results are written
+    to 'results'; coord, cm_n, cm_i, off_center, new_coord are buffers of
+    length ndim.
+    """
     SHIFT_THRESH = 0.6
     GOOD_ENOUGH_THRESH = 0.01
+    ndim = coords.shape[1]
+    mask_size = mask_offsets.shape[0]
     # Column indices into the 'results' array
-    MASS_COL = 2
-    RG_COL = 3
-    ECC_COL = 4
-    SIGNAL_COL = 5
-
-    square_size = 2*radius + 1
+    MASS_COL = ndim
+    RG_COL = ndim + 1
+    ECC_COL = ndim + 2
+    SIGNAL_COL = ndim + 3
 
     for feat in range(N):
-        # Define the circular neighborhood of (x, y).
-        for dim in range(2):
+        # Define the circular neighborhood of the feature.
+        square = 0  # flat index of the corner of the neighborhood
+        for dim in range(ndim):
             coord[dim] = coords[feat, dim]
+            square += (coord[dim] - radius[dim]) * strides[dim]
             cm_n[dim] = 0.
-        square0 = int(round(coord[0])) - radius
-        square1 = int(round(coord[1])) - radius
         mass_ = 0.0
-        for i in range(square_size):
-            for j in range(square_size):
-                if mask[i, j] != 0:
-                    px = image[square0 + i, square1 + j]
-                    cm_n[0] += px*i
-                    cm_n[1] += px*j
-                    mass_ += px
-
-        for dim in range(2):
-            cm_n[dim] /= mass_
-            cm_i[dim] = cm_n[dim] - radius + coord[dim]
-        allow_moves = True
+        for k in range(mask_size):
+            px = image[square + mask_offsets[k]]
+            for dim in range(ndim):
+                cm_n[dim] += px*mask_coords[k, dim]
+            mass_ += px
+
+        for dim in range(ndim):
+            if mass_ == 0:  # avoid divide-by-zero errors
+                cm_n[dim] = radius[dim]
+            else:
+                cm_n[dim] /= mass_
+            cm_i[dim] = cm_n[dim] - radius[dim] + coord[dim]
         for iteration in range(max_iterations):
-            for dim in range(2):
-                off_center[dim] = cm_n[dim] - radius
-            for dim in range(2):
+            for dim in range(ndim):
+                off_center[dim] = cm_n[dim] - radius[dim]
+            for dim in range(ndim):
                 if abs(off_center[dim]) > GOOD_ENOUGH_THRESH:
                     break  # Proceed through iteration.
             else:
@@ -339,88 +758,80 @@ def _numba_refine(raw_image, image, radius, coords, N, max_iterations,
 
             # If we're off by more than half a pixel in any direction, move.
             do_move = False
-            if allow_moves:
-                for dim in range(2):
-                    if abs(off_center[dim]) > SHIFT_THRESH:
-                        do_move = True
-                        break
+            for dim in range(ndim):
+                if abs(off_center[dim]) > SHIFT_THRESH:
+                    do_move = True
+                    break
+
+            # If we're off by less than half a pixel, stop. Unlike the
+            # other engines, this one does not interpolate (see refine).
+            if not do_move:
+                break
 
-            if do_move:
-                # In here, coord is an integer.
-                for dim in range(2):
-                    new_coord[dim] = int(round(coord[dim]))
-                    oc = off_center[dim]
-                    if oc > SHIFT_THRESH:
-                        new_coord[dim] += 1
-                    elif oc < - SHIFT_THRESH:
-                        new_coord[dim] += -1
-                    # Don't move outside the image!
-                    if new_coord[dim] < radius:
-                        new_coord[dim] = radius
-                    upper_bound = shape[dim] - radius - 1
-                    if new_coord[dim] > upper_bound:
-                        new_coord[dim] = upper_bound
+            # In here, coord is an integer.
+            square = 0
+            for dim in range(ndim):
+                new_coord[dim] = coord[dim]
+                oc = off_center[dim]
+                if oc > SHIFT_THRESH:
+                    new_coord[dim] += 1
+                elif oc < - SHIFT_THRESH:
+                    new_coord[dim] += -1
+                # Don't move outside the image!
+                if new_coord[dim] < radius[dim]:
+                    new_coord[dim] = radius[dim]
+                upper_bound = shape[dim] - radius[dim] - 1
+                if new_coord[dim] > upper_bound:
+                    new_coord[dim] = upper_bound
                 # Update slice to shifted position.
-                square0 = new_coord[0] - radius
-                square1 = new_coord[1] - radius
-                for dim in range(2):
-                    cm_n[dim] = 0.
+                square += (new_coord[dim] - radius[dim]) * strides[dim]
+                cm_n[dim] = 0.
 
-            # If we're off by less than half a pixel, interpolate.
-            else:
-                break
-                # TODO Implement this for numba.
-                # Remember to zero cm_n somewhere in here.
-                # Here, coord is a float. We are off the grid.
-                # neighborhood = ndimage.shift(neighborhood, -off_center,
-                #                              order=2, mode='constant', cval=0)
-                # new_coord = np.float_(coord) + off_center
-                # Disallow any whole-pixels moves on future iterations.
-                # allow_moves = False
-
-            # cm_n was re-zeroed above in an unrelated loop
             mass_ = 0.
-            for i in range(square_size):
-                for j in range(square_size):
-                    if mask[i, j] != 0:
-                        px = image[square0 + i, square1 + j]
-                        cm_n[0] += px*i
-                        cm_n[1] += px*j
-                        mass_ += px
-
-            for dim in range(2):
-                cm_n[dim] /= mass_
-                cm_i[dim] = cm_n[dim] - radius + new_coord[dim]
+            for k in range(mask_size):
+                px = image[square + mask_offsets[k]]
+                for dim in range(ndim):
+                    cm_n[dim] += px*mask_coords[k, dim]
+                mass_ += px
+
+            for dim in range(ndim):
+                if mass_ == 0:
+                    cm_n[dim] = radius[dim]
+                else:
+                    cm_n[dim] /= mass_
+                cm_i[dim] = cm_n[dim] - radius[dim] + new_coord[dim]
                 coord[dim] = new_coord[dim]
         # matplotlib and ndimage have opposite conventions for xy <-> yx.
-        results[feat, 0] = cm_i[1]
-        results[feat, 1] = cm_i[0]
+        for dim in range(ndim):
+            results[feat, dim] = cm_i[ndim - 1 - dim]
 
         # Characterize the neighborhood of our final centroid.
         mass_ = 0.
         Rg_ = 0.
         ecc1 = 0.
         ecc2 = 0.
-        signal_ = 0.
-        for i in range(square_size):
-            for j in range(square_size):
-                if mask[i, j] != 0:
-                    px = image[square0 + i, square1 + j]
-                    mass_ += px
-                    # Will short-circuiting if characterize=False slow it down?
-                    if not characterize:
-                        continue
-                    Rg_ += r2_mask[i, j]*px
-                    ecc1 += cmask[i, j]*px
-                    ecc2 += smask[i, j]*px
-                    raw_px = raw_image[square0 + i, square1 + j]
-                    if raw_px > signal_:
-                        signal_ = px
+        signal_ = -np.inf
+        for k in range(mask_size):
+            px = image[square + mask_offsets[k]]
+            mass_ += px
+            # Will short-circuiting if characterize=False slow it down?
+            if not characterize:
+                continue
+            Rg_ += r2_mask[k]*px
+            ecc1 += cmask[k]*px
+            ecc2 += smask[k]*px
+            raw_px = raw_image[square + mask_offsets[k]]
+            if raw_px > signal_:
+                signal_ = raw_px
         results[feat, MASS_COL] = mass_
         if characterize:
-            results[feat, RG_COL] = np.sqrt(Rg_/mass_)
-            center_px = image[square0 + radius, square1 + radius]
-            results[feat, ECC_COL] = np.sqrt(ecc1**2 + ecc2**2)/(mass_ - center_px + 1e-6)
+            if mass_ == 0:
+                results[feat, RG_COL] = np.nan
+            else:
+                results[feat, RG_COL] = np.sqrt(Rg_/mass_)
+            center_px = image[square + center_offset]
+            results[feat, ECC_COL] = (np.sqrt(ecc1**2 + ecc2**2) /
+                                      (mass_ - center_px + 1e-6))
             results[feat, SIGNAL_COL] = signal_  # black_level subtracted later
 
     return 0  # Unused
@@ -430,7 +841,8 @@ def locate(raw_image, diameter, minmass=100., maxsize=None, separation=None,
            noise_size=1, smoothing_size=None, threshold=None, invert=False,
            percentile=64, topn=None, preprocess=True, max_iterations=10,
            filter_before=True, filter_after=True,
-           characterize=True, engine='auto'):
+           characterize=True, engine='auto', dilation='auto',
+           tile_size=None, stack=False, dtype=None, as_array=False):
     """Locate Gaussian-like blobs of some approximate size in an image.
 
     Preprocess the image by performing a band pass and a threshold.
@@ -487,7 +899,36 @@ def locate(raw_image, diameter, minmass=100., maxsize=None, separation=None,
         features. True by default.
     characterize : boolean
         Compute "extras": eccentricity, signal, ep. True by default.
-    engine : {'auto', 'python', 'numba'}
+    engine : {'auto', 'python', 'numba', 'vectorized'}
+    dilation : {'auto', 'ndimage', 'separable'}
+        Method used to find local maxima. See local_maxima for details.
+    tile_size : integer or tuple, optional
+        If given, process the image in overlapping tiles of this size, so
+        that the temporary arrays are bounded by the tile size rather than
+        by the image size. Each tile is read from the image separately, so
+        that images that do not fit in memory can be given as numpy.memmap.
+        Features found in the overlaps are merged. The tiles are scaled to
+        a common maximum, which takes a first bandpass pass over all tiles.
+        The bandpassed tiles are not kept, to keep memory bounded, so the
+        bandpass (the most expensive stage) is computed twice, and tiled
+        locating takes roughly twice as long as locating the whole image.
+        The percentile threshold and the noise (used for ep) are determined
+        per tile. None by default.
+    stack : boolean
+        If True, raw_image is a stack of images along its first axis, such
+        as a (T, Y, X) array of frames. The images are preprocessed together
+        in vectorized chunks, which saves overhead for many small images,
+        and the result has a 'frame' column with the index of each image in
+        the stack. False by default.
+    dtype : {None, numpy.float32, numpy.float64}
+        Floating point type used for preprocessing. Single precision halves
+        the memory traffic, which limits the speed for large images. By
+        default, float32 images are processed in single precision, and all
+        others in double precision.
+    as_array : boolean
+        Return the features as a structured numpy array, with a field for
+        each column, instead of a DataFrame. This avoids the overhead of
+        pandas when there are few features. Default False.
 
     See Also
     --------
@@ -508,162 +949,805 @@ def locate(raw_image, diameter, minmass=100., maxsize=None, separation=None,
 
     """
 
-    # Validate parameters and set defaults.
-    raw_image = np.squeeze(raw_image)
-    shape = raw_image.shape
-    ndim = len(shape)
+    return Locator(diameter, minmass, maxsize, separation, noise_size,
+                   smoothing_size, threshold, invert, percentile, topn,
+                   preprocess, max_iterations, filter_before, filter_after,
+                   characterize, engine, dilation, tile_size,
+                   stack=stack, dtype=dtype, as_array=as_array)(raw_image)
 
-    diameter = validate_tuple(diameter, ndim)
-    diameter = tuple([int(x) for x in diameter])
-    if not np.all([x & 1 for x in diameter]):
-        raise ValueError("Feature diameter must be an odd integer. Round up.")
-    radius = tuple([x//2 for x in diameter])
 
-    if separation is None:
-        separation = tuple([x + 1 for x in diameter])
-    else:
-        separation = validate_tuple(separation, ndim)
+class Locator(object):
+    """Locate features in many images, reusing work between them.
 
-    if smoothing_size is None:
-        smoothing_size = diameter
-    else:
-        smoothing_size = validate_tuple(smoothing_size, ndim)
-
-    noise_size = validate_tuple(noise_size, ndim)
-
-    # Don't do characterization for rectangular pixels/voxels
-    if diameter[1:] != diameter[:-1]:
-        characterize = False
-
-    # Check whether the image looks suspiciously like a color image.
-    if 3 in shape or 4 in shape:
-        dim = raw_image.ndim
-        warnings.warn("I am interpreting the image as {0}-dimensional. "
-                      "If it is actually a {1}-dimensional color image, "
-                      "convert it to grayscale first.".format(dim, dim-1))
-    if preprocess:
-        if invert:
-            # It is tempting to do this in place, but if it is called multiple
-            # times on the same image, chaos reigns.
-            if np.issubdtype(raw_image.dtype, np.integer):
-                max_value = np.iinfo(raw_image.dtype).max
-                raw_image = raw_image ^ max_value
+    A Locator is made from the same parameters as locate, and calling it on
+    an image gives the same result as locate. The parameters are validated
+    only once, and the Fourier kernel and work buffers of the preprocessing
+    are kept for the next image of the same shape and dtype. This saves
+    time on video streams of identical frames. batch uses a Locator.
+
+    Parameters
+    ----------
+    See locate. In addition:
+
+    noise_interval : integer
+        Measure the background noise (used for ep) only in every Nth image,
+        and reuse the latest measurement in between. The count is kept per
+        thread or worker process, and each image of a stack counts. The
+        tiles of an image are counted as one image. Default is 1, measuring
+        it in every image.
+    profile : boolean
+        Record the wall time of each stage of locating, and the number of
+        candidate features after each stage. The record of the latest image
+        (in this thread) is in last_profile. Default False.
+
+    Examples
+    --------
+    >>> locator = Locator(11, minmass=200)
+    >>> features = [locator(frame) for frame in frames]
+
+    >>> locator = Locator(11, minmass=200, profile=True)
+    >>> features = locator(frame)
+    >>> locator.last_profile['refine_time']
+    """
+
+    # Work buffers are kept for this many shapes and dtypes (per thread).
+    MAX_WORKSPACES = 8
+
+    def __init__(self, diameter, minmass=100., maxsize=None, separation=None,
+                 noise_size=1, smoothing_size=None, threshold=None,
+                 invert=False, percentile=64, topn=None, preprocess=True,
+                 max_iterations=10, filter_before=True, filter_after=True,
+                 characterize=True, engine='auto', dilation='auto',
+                 tile_size=None, noise_interval=1, stack=False,
+                 dtype=None, profile=False, as_array=False):
+        if tile_size is not None and stack:
+            raise ValueError("A stack of images cannot be located in tiles.")
+        if (not isinstance(noise_interval, six.integer_types) or
+                noise_interval < 1):
+            raise ValueError("noise_interval must be a positive integer.")
+        self.diameter = diameter
+        self.minmass = minmass
+        self.maxsize = maxsize
+        self.separation = separation
+        self.noise_size = noise_size
+        self.smoothing_size = smoothing_size
+        self.threshold = threshold
+        self.invert = invert
+        self.percentile = percentile
+        self.topn = topn
+        self.preprocess = preprocess
+        self.max_iterations = max_iterations
+        self.filter_before = filter_before
+        self.filter_after = filter_after
+        self.characterize = characterize
+        self.engine = engine
+        self.dilation = dilation
+        self.tile_size = tile_size
+        self.noise_interval = noise_interval
+        self.stack = stack
+        self.dtype = dtype
+        self.profile = profile
+        self.as_array = as_array
+        self._validated = {}
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Work buffers are not worth pickling (e.g. to send the Locator to a
+        # worker process), and they are per thread anyway.
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def last_profile(self):
+        """The profile of the latest image located in this thread, as a dict
+        of stage times (in seconds) and candidate counts, or None. For a
+        stack or tiled image, this covers the whole stack or image."""
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return None
+        return profile.record
+
+    def __call__(self, raw_image, positions=None, search_range=None):
+        """Locate features in an image. See locate.
+
+        If positions are given, look for features only within search_range
+        of them, for example where features were in the previous frame of a
+        video. This saves work in sparse images. The windows around the
+        positions are scaled together, as if their maximum were that of
+        the image, and they take the percentile threshold of the latest
+        whole image located in this thread. (If there is none, each window
+        is thresholded by itself.) Mass, signal and minmass mean the same
+        as in a whole image if its brightest feature is in a window.
+
+        Parameters
+        ----------
+        raw_image : array
+        positions : array, optional
+            Shape (N, ndim), in the order of the coordinate columns of the
+            features, (x, y[, z]).
+        search_range : number or tuple
+            Maximum distance from positions, in pixels, along each axis.
+            Required if positions are given.
+        """
+        if positions is not None and (self.stack or
+                                      self.tile_size is not None):
+            raise ValueError("Locating near given positions does not work "
+                             "with a stack of images or in tiles.")
+        if positions is not None and search_range is None:
+            raise ValueError("Give a search_range with the positions.")
+        if self.profile:
+            profile = self._local.profile = _Profile()
+        if self.stack:
+            # Keep the stack axis, even if it has length 1.
+            raw_image = np.asarray(raw_image)
+            shape = raw_image.shape[1:]
+        else:
+            raw_image = np.squeeze(raw_image)
+            shape = raw_image.shape
+        self._validate(len(shape))
+
+        # Check whether the image looks suspiciously like a color image.
+        if 3 in shape or 4 in shape:
+            dim = len(shape)
+            warnings.warn("I am interpreting the image as {0}-dimensional. "
+                          "If it is actually a {1}-dimensional color image, "
+                          "convert it to grayscale first.".format(dim, dim-1))
+
+        if self.stack:
+            f = self._locate_stack(raw_image)
+        else:
+            self._count_image()
+            if positions is not None:
+                f = self._locate_near(raw_image, positions, search_range)
+            elif self.tile_size is None:
+                f = self._locate(raw_image, self.topn, as_array=self.as_array)
             else:
-                # To avoid degrading performance, assume gamut is zero to one.
-                # Have you ever encountered an image of unnormalized floats?
-                raw_image = 1 - raw_image
-        image = bandpass(raw_image, noise_size, smoothing_size, threshold)
-    else:
-        image = raw_image.copy()
-    # Coerce the image into integer type. Rescale to fill dynamic range.
-    if np.issubdtype(raw_image.dtype, np.integer):
-        dtype = raw_image.dtype
-    else:
-        dtype = np.uint8
-    image = scale_to_gamut(image, dtype)
+                f = self._locate_tiled(raw_image)
+        if self.as_array and isinstance(f, DataFrame):
+            f = _frame_to_array(f)
+
+        # If this is a pims Frame object, it has a frame number.
+        # Tag it on; this is helpful for parallelization.
+        if (not self.stack and hasattr(raw_image, 'frame_no') and
+                raw_image.frame_no is not None):
+            f = _set_frame(f, raw_image.frame_no)
+        if self.profile:
+            profile.finish(len(f))
+        return f
+
+    def _profile(self):
+        """Return the profile of the current call, or a stand-in that
+        records nothing."""
+        if self.profile:
+            return self._local.profile
+        return _NO_PROFILE
+
+    def _validate(self, ndim):
+        """Validate the parameters and set defaults for ndim dimensions."""
+        if ndim in self._validated:
+            return self._validated[ndim]
+
+        diameter = validate_tuple(self.diameter, ndim)
+        diameter = tuple([int(x) for x in diameter])
+        if not np.all([x & 1 for x in diameter]):
+            raise ValueError("Feature diameter must be an odd integer. "
+                             "Round up.")
+        radius = tuple([x//2 for x in diameter])
+
+        if self.separation is None:
+            separation = tuple([x + 1 for x in diameter])
+        else:
+            separation = validate_tuple(self.separation, ndim)
 
-    # Set up a DataFrame for the final results.
-    if image.ndim < 4:
-        coord_columns = ['x', 'y', 'z'][:image.ndim]
-    else:
-        coord_columns = map(lambda i: 'x' + str(i), range(image.ndim))
-    char_columns = ['mass']
-    if characterize:
-        char_columns += ['size', 'ecc', 'signal']
-    columns = coord_columns + char_columns
-    # The 'ep' column is joined on at the end, so we need this...
-    if characterize:
-        all_columns = columns + ['ep']
-    else:
-        all_columns = columns
+        if self.smoothing_size is None:
+            smoothing_size = diameter
+        else:
+            smoothing_size = validate_tuple(self.smoothing_size, ndim)
+
+        noise_size = validate_tuple(self.noise_size, ndim)
+        if self.preprocess and np.any([x*2 >= y for (x, y) in
+                                       zip(noise_size, smoothing_size)]):
+            raise ValueError("The smoothing length scale must be more" +
+                             "than twice the noise length scale.")
+
+        # Don't do characterization for rectangular pixels/voxels
+        characterize = self.characterize and diameter[1:] == diameter[:-1]
+
+        params = dict(diameter=diameter, radius=radius, separation=separation,
+                      smoothing_size=smoothing_size, noise_size=noise_size,
+                      characterize=characterize,
+                      margin=_locate_margin(diameter, separation,
+                                            smoothing_size))
+        self._validated[ndim] = params
+        return params
+
+    def _columns(self, ndim):
+        """Columns of the features found in ndim dimensions."""
+        if ndim < 4:
+            coord_columns = ['x', 'y', 'z'][:ndim]
+        else:
+            coord_columns = ['x' + str(i) for i in range(ndim)]
+        char_columns = ['mass']
+        if self._validate(ndim)['characterize']:
+            char_columns += ['size', 'ecc', 'signal', 'ep']
+        return coord_columns + char_columns
+
+    def _workspace(self, shape, dtype):
+        """Return the Fourier kernel and work buffers for images of this
+        shape and dtype, creating them if necessary."""
+        workspaces = getattr(self._local, 'workspaces', None)
+        if workspaces is None:
+            workspaces = self._local.workspaces = {}
+        key = (shape, np.dtype(dtype))
+        if key in workspaces:
+            return workspaces[key]
+        if len(workspaces) >= self.MAX_WORKSPACES:
+            workspaces.clear()
+
+        params = self._validate(len(shape))
+        workspace = dict()
+        if self.preprocess:
+            noise_size = params['noise_size']
+            if gaussian_method(shape, noise_size) == 'fourier':
+                float_dtype = _float_dtype(dtype, self.dtype)
+                workspace['kernel'] = _fourier_gaussian_kernel(
+                    shape, noise_size).astype(float_dtype)
+            else:
+                workspace['kernel'] = None
+            workspace['boxcar'] = (np.empty(shape, dtype),
+                                   np.empty(shape, dtype))
+        # Coerce the image into integer type.
+        if np.issubdtype(dtype, np.integer):
+            workspace['gamut'] = np.empty(shape, dtype)
+        else:
+            workspace['gamut'] = np.empty(shape, np.uint8)
+        workspaces[key] = workspace
+        return workspace
+
+    def _preprocess(self, raw_image, stack=False):
+        """Invert and bandpass the image, or each image of a stack.
+
+        Returns (raw_image, image): the (inverted) raw image and the
+        processed image, which is not yet scaled to the integer gamut.
+        """
+        shape = raw_image.shape[1:] if stack else raw_image.shape
+        params = self._validate(len(shape))
+        if self.preprocess:
+            if self.invert:
+                # It is tempting to do this in place, but if it is called
+                # multiple times on the same image, chaos reigns.
+                if np.issubdtype(raw_image.dtype, np.integer):
+                    max_value = np.iinfo(raw_image.dtype).max
+                    raw_image = raw_image ^ max_value
+                else:
+                    # To avoid degrading performance, assume gamut is zero to
+                    # one. Have you ever encountered an image of unnormalized
+                    # floats?
+                    raw_image = 1 - raw_image
+            workspace = self._workspace(shape, raw_image.dtype)
+            # The boxcar buffers only fit single images.
+            buffers = None if stack else workspace['boxcar']
+            image = _bandpass(raw_image, params['noise_size'],
+                              params['smoothing_size'], self.threshold,
+                              workspace['kernel'], buffers, stack=stack,
+                              dtype=self.dtype)
+        else:
+            image = raw_image.copy()
+        self._profile().stage('preprocess')
+        return raw_image, image
+
+    def _locate(self, raw_image, topn, image_max=None, as_array=False):
+        """Locate features in a whole image.
+
+        If image_max is given, the preprocessed image is scaled as if that
+        were its maximum. See scale_to_gamut.
+        """
+        raw_image, image = self._preprocess(raw_image)
+        return self._locate_processed(raw_image, image, topn, image_max,
+                                      as_array)
+
+    def _locate_processed(self, raw_image, image, topn, image_max=None,
+                          as_array=False):
+        """Locate features in an image, given the (inverted) raw image and
+        the processed image returned by _preprocess. See _locate."""
+        refined_coords, bandpassed = self._find_coords(raw_image, image, topn,
+                                                       image_max)
+        return self._to_features(refined_coords, raw_image.ndim, raw_image,
+                                 bandpassed, as_array)
+
+    def _find_coords(self, raw_image, image, topn, image_max=None,
+                     threshold=None):
+        """Find and refine features. See _locate_processed.
+
+        If threshold is given, it replaces the percentile threshold of the
+        image (see local_maxima), in the units of the image before scaling.
+        When the whole image is located (without image_max and threshold),
+        its threshold is kept in these units for _locate_near.
+
+        Returns (refined_coords, bandpassed): an array with a row for each
+        feature and the columns of the features (except ep), and the
+        bandpassed image (or None), for measuring noise.
+        """
+        params = self._validate(raw_image.ndim)
+        radius = params['radius']
+        characterize = params['characterize']
+        minmass = self.minmass
+        maxsize = self.maxsize
+        profile = self._profile()
+
+        # Keep the bandpassed image, to find the background for measuring
+        # noise below.
+        bandpassed = image if self.preprocess else None
+        whole_image = image_max is None and threshold is None
+        if image_max is None:
+            image_max = image.max()
+        # Coerce the image into integer type. Rescale to fill dynamic range.
+        gamut = self._workspace(raw_image.shape, raw_image.dtype)['gamut']
+        # The processed image is ours, so scale it in place. (Its nonzero
+        # pixels, used by _measure_noise, stay nonzero.)
+        image = scale_to_gamut(image, gamut.dtype, image_max, out=gamut,
+                               dtype=self.dtype, overwrite_input=True)
+        scale = np.iinfo(gamut.dtype).max / image_max
+        if whole_image:
+            threshold = percentile_threshold(image, self.percentile)
+            self._local.threshold = threshold / scale
+        elif threshold is not None:
+            threshold = threshold * scale
+        profile.stage('scale')
+
+        # The 'ep' column is joined on at the end.
+        columns = self._columns(image.ndim)
+        if characterize:
+            columns = columns[:-1]
+        no_features = np.empty((0, len(columns)))
+
+        # Find local maxima, excluding a zone at the edges of the image.
+        coords = local_maxima(image, radius, self.percentile,
+                              params['margin'], self.dilation, threshold)
+        count_maxima = coords.shape[0]
+        profile.stage('maxima')
+        profile.count('maxima', count_maxima)
+
+        if count_maxima == 0:
+            return no_features, bandpassed
+
+        # Proactively filter based on estimated mass/size before
+        # refining positions.
+        if self.filter_before:
+            # Estimate mass (and size) for all maxima at once.
+            approx_mass, approx_size = _estimate_mass_and_size(
+                image, radius, coords, size=maxsize is not None)
+            condition = approx_mass > minmass
+            if maxsize is not None:
+                condition &= approx_size < maxsize
+            coords = coords[condition]
+        count_qualified = coords.shape[0]
+        profile.stage('prefilter')
+        profile.count('prefiltered', count_qualified)
+
+        if count_qualified == 0:
+            warnings.warn("No maxima survived mass- and size-based "
+                          "prefiltering.")
+            return no_features, bandpassed
+
+        # Refine their locations and characterize mass, size, etc.
+        # Duplicates are removed here, rather than in refine, to profile
+        # that separately.
+        stats = dict() if self.profile else None
+        refined_coords = refine(raw_image, image, radius, coords, 0,
+                                self.max_iterations, self.engine,
+                                characterize, stats=stats)
+        profile.stage('refine')
+        refined_coords = _remove_duplicates(refined_coords,
+                                            params['separation'], image.ndim)
+        profile.stage('dedup')
+        profile.count('refined', refined_coords.shape[0])
+        if stats:
+            iterations = stats['iterations']
+            profile.count('iterations', int(iterations.sum()))
+            profile.count('unconverged',
+                          int(np.sum(iterations == self.max_iterations)))
+
+        # Filter again, using final ("exact") mass -- and size, if set.
+        MASS_COLUMN_INDEX = image.ndim
+        SIZE_COLUMN_INDEX = image.ndim + 1
+        exact_mass = refined_coords[:, MASS_COLUMN_INDEX]
+        if self.filter_after:
+            condition = exact_mass > minmass
+            if maxsize is not None:
+                exact_size = refined_coords[:, SIZE_COLUMN_INDEX]
+                condition &= exact_size < maxsize
+            refined_coords = refined_coords[condition]
+            exact_mass = exact_mass[condition]  # used below by topn
+        count_qualified = refined_coords.shape[0]
+
+        if count_qualified == 0:
+            warnings.warn("No maxima survived mass- and size-based "
+                          "filtering.")
+            return no_features, bandpassed
+
+        if topn is not None and count_qualified > topn:
+            if topn == 1:
+                # special case for high performance and correct shape
+                refined_coords = refined_coords[np.argmax(exact_mass)]
+                refined_coords = refined_coords.reshape(1, -1)
+            else:
+                refined_coords = refined_coords[np.argsort(exact_mass)][-topn:]
+        profile.stage('filter')
+        return refined_coords, bandpassed
+
+    def _to_features(self, refined_coords, ndim, raw_image, bandpassed,
+                     as_array=False):
+        """Make a DataFrame (or a structured array) of features from the
+        array of _find_coords, adding ep. raw_image and bandpassed may be
+        lists of images, whose backgrounds are pooled to measure the noise."""
+        params = self._validate(ndim)
+        columns = self._columns(ndim)
+        if len(refined_coords) == 0:
+            if as_array:
+                return _to_array(np.empty((0, len(columns))), columns)
+            return DataFrame(columns=columns)
+
+        if params['characterize']:
+            # Estimate the uncertainty in position using signal (measured in
+            # refine) and noise (measured here below).
+            signal = refined_coords[:, columns.index('signal')]
+            size = refined_coords[:, columns.index('size')]
+            black_level, noise = self._measure_noise(raw_image, bandpassed)
+            signal -= black_level
+            ep = uncertainty._static_error(noise/signal, size,
+                                           params['diameter'][0],
+                                           params['noise_size'][0])
+            refined_coords = np.column_stack([refined_coords, ep])
+            self._profile().stage('noise')
+        if as_array:
+            return _to_array(refined_coords, columns)
+        return DataFrame(refined_coords, columns=columns)
+
+    def _locate_stack(self, raw_stack):
+        """Locate features in each image of a stack. See locate (stack)."""
+        # Preprocess as many images at once as the bandpass processes in
+        # one chunk.
+        frame_size = int(np.prod(raw_stack.shape[1:]))
+        chunksize = max(1, preprocessing.STACK_CHUNK_SIZE // frame_size)
+        results = []
+        for start in range(0, len(raw_stack), chunksize):
+            raw_chunk, chunk = self._preprocess(
+                raw_stack[start:start + chunksize], stack=True)
+            for i in range(len(chunk)):
+                self._count_image()
+                f = self._locate_processed(raw_chunk[i], chunk[i], self.topn)
+                f['frame'] = start + i
+                results.append(f)
+        if len(results) == 0:
+            return DataFrame(columns=self._columns(raw_stack.ndim - 1) +
+                             ['frame'])
+        return pd.concat(results, ignore_index=True)
+
+    def _count_image(self):
+        """Count a new image, for noise_interval."""
+        local = self._local
+        count = getattr(local, 'noise_count', 0)
+        local.noise_count = count + 1
+        local.noise_due = count % self.noise_interval == 0
+
+    def _measure_noise(self, raw_image, bandpassed):
+        """Measure the black level and noise of the background, or reuse
+        the latest measurement. See noise_interval.
+
+        raw_image and bandpassed may be lists of images (such as the windows
+        of _locate_near), whose backgrounds are taken together.
+        """
+        local = self._local
+        if local.noise_due or not hasattr(local, 'noise'):
+            if not isinstance(raw_image, list):
+                diameter = self._validate(raw_image.ndim)['diameter']
+                local.noise = uncertainty.measure_noise(
+                    raw_image, diameter, self.threshold, bandpassed)
+            else:
+                diameter = self._validate(raw_image[0].ndim)['diameter']
+                background = np.concatenate([
+                    image[~uncertainty.roi(image, diameter, self.threshold,
+                                           bp)]
+                    for (image, bp) in zip(raw_image, bandpassed)])
+                local.noise = background.mean(), background.std()
+        return local.noise
+
+    def _locate_tiled(self, raw_image):
+        """Locate features in overlapping tiles. See locate (tile_size)."""
+        shape = raw_image.shape
+        ndim = len(shape)
+        params = self._validate(ndim)
+        tile_size = validate_tuple(self.tile_size, ndim)
+        halo = self._halo(params)
+        tiles = []
+        for start in itertools.product(*[range(0, s, t) for (s, t) in
+                                         zip(shape, tile_size)]):
+            stop = [min(st + t, s) for (st, t, s) in
+                    zip(start, tile_size, shape)]
+            tiles.append(_region(start, stop, halo, shape))
+
+        # The processed tiles must be scaled to the integer gamut
+        # consistently, so that minmass means the same everywhere. This
+        # takes a first pass.
+        image_max = None
+        for outer, core in tiles:
+            _, image = self._preprocess(np.array(raw_image[outer]))
+            tile_max = image[core].max()
+            if image_max is None or tile_max > image_max:
+                image_max = tile_max
+
+        # The tiles are bandpassed again here, rather than kept from the
+        # first pass, so that only one tile is in memory at a time.
+        results = []
+        with warnings.catch_warnings():
+            # Many tiles may be empty; warn only once, below.
+            _ignore_empty_region_warnings()
+            for outer, core in tiles:
+                f = self._locate(np.array(raw_image[outer]), None, image_max)
+                results.append(_owned_features(f, outer, core))
+        return self._merge_regions(results, ndim)
+
+    def _locate_near(self, raw_image, positions, search_range):
+        """Locate features within search_range of positions. See __call__."""
+        shape = raw_image.shape
+        ndim = len(shape)
+        params = self._validate(ndim)
+        halo = self._halo(params)
+        reach = np.ceil(validate_tuple(search_range, ndim)).astype(np.intp)
+        # Pixel positions, in the order of the image axes.
+        centers = np.floor(np.asarray(positions, dtype=np.float64)[:, ::-1] +
+                           0.5).astype(np.intp)
+        boxes = [(np.clip(c - reach, 0, shape), np.clip(c + reach + 1, 0, shape))
+                 for c in centers]
+        boxes = [(start, stop) for (start, stop) in boxes
+                 if np.all(stop > start)]
+        # Windows that would overlap are merged, to process each pixel once.
+        boxes = _merge_boxes(boxes, 2*np.array(halo))
+        regions = [_region(start, stop, halo, shape) for (start, stop) in boxes]
+        if len(regions) == 0:
+            return self._merge_regions([], ndim)
+
+        # The windows are small, so keep them all processed, and scale them
+        # to the integer gamut consistently. See _locate_tiled. Threshold
+        # them like the latest whole image, if any, rather than each by
+        # itself, so that they find the same maxima as a full scan would.
+        processed = [self._preprocess(np.array(raw_image[outer]))
+                     for (outer, core) in regions]
+        image_max = max([image[core].max() for ((_, image), (_, core))
+                         in zip(processed, regions)])
+        threshold = getattr(self._local, 'threshold', None)
+        # Find the features in each window, but make one DataFrame of all
+        # of them, measuring the noise in the windows together. This saves
+        # overhead per window.
+        results = []
+        raw_windows = []
+        bandpassed = []
+        with warnings.catch_warnings():
+            _ignore_empty_region_warnings()
+            for (raw_window, window), (outer, core) in zip(processed, regions):
+                coords, bp = self._find_coords(raw_window, window, None,
+                                               image_max, threshold)
+                coords = coords[_owned(coords[:, :ndim], core)]
+                coords[:, :ndim] += [o.start for o in reversed(outer)]
+                results.append(coords)
+                raw_windows.append(raw_window)
+                bandpassed.append(bp)
+        f = self._to_features(np.concatenate(results), ndim, raw_windows,
+                              bandpassed)
+        return self._merge_regions([f], ndim)
+
+    def _halo(self, params):
+        """Width of the margin that a region of the image needs around it
+        to be processed as part of the whole image."""
+        # The halo must hold everything that influences a feature inside
+        # the region: the bandpass kernels, the zone excluded at the edges,
+        # and neighbors that may be merged with it.
+        return [int(np.ceil(4*ns)) + sm + m + int(np.ceil(sep)) for
+                (ns, sm, m, sep) in zip(params['noise_size'],
+                                        params['smoothing_size'],
+                                        params['margin'],
+                                        params['separation'])]
+
+    def _merge_regions(self, results, ndim):
+        """Combine the features found in regions of an image (see
+        _owned_features), removing duplicates and applying topn."""
+        if len(results) == 0:
+            results = [DataFrame(columns=self._columns(ndim))]
+        f = pd.concat(results, ignore_index=True)
+
+        # A feature on the border of two cores may be found by both regions,
+        # at slightly different positions. Merge these, as refine does.
+        separation = self._validate(ndim)['separation']
+        if len(f) > 0 and np.all(np.greater(separation, 0)):
+            positions = f[f.columns[:ndim]].values/list(reversed(separation))
+            f = f.drop(f.index[_find_duplicates(positions, f['mass'].values)])
+            f.reset_index(drop=True, inplace=True)
+
+        topn = self.topn
+        if len(f) == 0:
+            warnings.warn("No maxima survived mass- and size-based filtering.")
+        elif topn is not None and len(f) > topn:
+            f = f.iloc[np.argsort(f['mass'].values)[-topn:]]
+            f.reset_index(drop=True, inplace=True)
+        return f
+
+
+def _ignore_empty_region_warnings():
+    """Ignore the warnings about regions of an image without features.
+    Use within warnings.catch_warnings()."""
+    for message in ['No maxima survived', 'Image contains no local maxima',
+                    'All local maxima were in the margins']:
+        warnings.filterwarnings('ignore', message)
+
+
+def _region(start, stop, halo, shape):
+    """Slices of a region of an image, from start to stop, with a halo.
+
+    Returns (outer, core): the slices of the region plus its halo (within
+    the image), and the slices of the region within the outer one.
+    """
+    outer = tuple([slice(max(st - h, 0), min(sp + h, s)) for
+                   (st, sp, h, s) in zip(start, stop, halo, shape)])
+    core = tuple([slice(st - o.start, sp - o.start) for
+                  (st, sp, o) in zip(start, stop, outer)])
+    return outer, core
+
+
+def _owned_features(f, outer, core):
+    """Keep only the features centered in the core of a region, and shift
+    them to the coordinates of the whole image."""
+    ndim = len(core)
+    f = f[_owned(f[f.columns[:ndim]].values, core)].copy()
+    f[f.columns[:ndim]] += [o.start for o in reversed(outer)]
+    return f
+
+
+def _owned(pos, core):
+    """Select the positions, in (x, y[, z]) order, centered in the core of a
+    region. Returns a boolean array."""
+    pixel = np.floor(pos + 0.5).astype(np.intp)[:, ::-1]
+    start = np.array([c.start for c in core])
+    stop = np.array([c.stop for c in core])
+    return np.all((pixel >= start) & (pixel < stop), axis=1)
+
+
+def _merge_boxes(boxes, gap):
+    """Merge boxes, given as (start, stop) arrays, that are closer than gap
+    along every axis into their bounding box, until none are."""
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for start, stop in boxes:
+            for i, (other_start, other_stop) in enumerate(result):
+                if (np.all(start < other_stop + gap) and
+                        np.all(other_start < stop + gap)):
+                    result[i] = (np.minimum(start, other_start),
+                                 np.maximum(stop, other_stop))
+                    merged = True
+                    break
+            else:
+                result.append((start, stop))
+        boxes = result
+    return boxes
+
+
+def _to_array(values, columns):
+    """Make a structured array with a float field for each column of values."""
+    result = np.empty(len(values), dtype=[(str(c), np.float64)
+                                          for c in columns])
+    for i, c in enumerate(columns):
+        result[str(c)] = values[:, i]
+    return result
+
+
+def _frame_to_array(f):
+    """Convert a DataFrame of features to a structured array."""
+    dtype = [(str(c), np.int64 if c == 'frame' else np.float64)
+             for c in f.columns]
+    result = np.empty(len(f), dtype=dtype)
+    for c in f.columns:
+        result[str(c)] = f[c].values
+    return result
+
+
+def _set_frame(features, frame_no):
+    """Set the frame column of a DataFrame or structured array of features,
+    adding it if necessary. Returns the features."""
+    if isinstance(features, DataFrame):
+        features['frame'] = frame_no
+        return features
+    if 'frame' not in features.dtype.names:
+        dtype = features.dtype.descr + [(str('frame'), np.int64)]
+        result = np.empty(len(features), dtype=dtype)
+        for name in features.dtype.names:
+            result[name] = features[name]
+        features = result
+    features['frame'] = frame_no
+    return features
+
+
+def _positions(features, ndim):
+    """Coordinates of a DataFrame or structured array of features, as an
+    array of shape (N, ndim) in (x, y[, z]) order."""
+    if isinstance(features, DataFrame):
+        return features.values[:, :ndim]
+    names = features.dtype.names[:ndim]
+    return np.column_stack([features[name] for name in names])
+
+
+class _Profile(object):
+    """Record the wall time of the stages of locating features in an image.
+
+    Each call to stage charges the time since the previous call (or since
+    the start) to the named stage. Repeated stages add up.
+    """
+
+    def __init__(self):
+        self.record = dict()
+        self._start = self._last = time.time()
+
+    def stage(self, name):
+        now = time.time()
+        key = name + '_time'
+        self.record[key] = self.record.get(key, 0.) + now - self._last
+        self._last = now
+
+    def count(self, name, value):
+        self.record[name] = self.record.get(name, 0) + value
+
+    def finish(self, count_features):
+        self.record['features'] = count_features
+        self.record['total_time'] = time.time() - self._start
+
+
+class _NoProfile(object):
+    """Stand-in for _Profile that records nothing, when not profiling."""
+
+    def stage(self, name):
+        pass
 
-    # Find local maxima.
-    # Define zone of exclusion at edges of image, avoiding
+    def count(self, name, value):
+        pass
+
+
+_NO_PROFILE = _NoProfile()
+
+# Columns of the profile returned by batch, in order.
+PROFILE_COLUMNS = ['frame', 'preprocess_time', 'scale_time', 'maxima_time',
+                   'prefilter_time', 'refine_time', 'dedup_time',
+                   'filter_time',
+                   'noise_time', 'total_time',
+                   'maxima', 'prefiltered', 'refined', 'features',
+                   'iterations', 'unconverged']
+
+
+def _locate_margin(diameter, separation, smoothing_size):
+    """Width of the zone at the edges of the image excluded by locate."""
+    # Avoid
     #   - Features with incomplete image data ("radius")
     #   - Extended particles that cannot be explored during subpixel
     #       refinement ("separation")
     #   - Invalid output of the bandpass step ("smoothing_size")
-    margin = tuple([max(rad, sep // 2 - 1, sm // 2) for (rad, sep, sm) in
-                    zip(radius, separation, smoothing_size)])
-    coords = local_maxima(image, radius, percentile, margin)
-    count_maxima = coords.shape[0]
-
-    if count_maxima == 0:
-        return DataFrame(columns=all_columns)
-
-    # Proactively filter based on estimated mass/size before
-    # refining positions.
-    if filter_before:
-        approx_mass = np.empty(count_maxima)  # initialize to avoid appending
-        for i in range(count_maxima):
-            approx_mass[i] = estimate_mass(image, radius, coords[i])
-        condition = approx_mass > minmass
-        if maxsize is not None:
-            approx_size = np.empty(count_maxima)
-            for i in range(count_maxima):
-                approx_size[i] = estimate_size(image, radius, coords[i],
-                                               approx_mass[i])
-            condition &= approx_size < maxsize
-        coords = coords[condition]
-    count_qualified = coords.shape[0]
-
-    if count_qualified == 0:
-        warnings.warn("No maxima survived mass- and size-based prefiltering.")
-        return DataFrame(columns=all_columns)
-
-    # Refine their locations and characterize mass, size, etc.
-    refined_coords = refine(raw_image, image, radius, coords, separation,
-                            max_iterations, engine, characterize)
-
-    # Filter again, using final ("exact") mass -- and size, if set.
-    MASS_COLUMN_INDEX = image.ndim
-    SIZE_COLUMN_INDEX = image.ndim + 1
-    exact_mass = refined_coords[:, MASS_COLUMN_INDEX]
-    if filter_after:
-        condition = exact_mass > minmass
-        if maxsize is not None:
-            exact_size = refined_coords[:, SIZE_COLUMN_INDEX]
-            condition &= exact_size < maxsize
-        refined_coords = refined_coords[condition]
-        exact_mass = exact_mass[condition]  # used below by topn
-    count_qualified = refined_coords.shape[0]
-
-    if count_qualified == 0:
-        warnings.warn("No maxima survived mass- and size-based filtering.")
-        return DataFrame(columns=all_columns)
-
-    if topn is not None and count_qualified > topn:
-        if topn == 1:
-            # special case for high performance and correct shape
-            refined_coords = refined_coords[np.argmax(exact_mass)]
-            refined_coords = refined_coords.reshape(1, -1)
-        else:
-            refined_coords = refined_coords[np.argsort(exact_mass)][-topn:]
-
-    f = DataFrame(refined_coords, columns=columns)
-
-    # Estimate the uncertainty in position using signal (measured in refine)
-    # and noise (measured here below).
-    if characterize:
-        black_level, noise = uncertainty.measure_noise(
-            raw_image, diameter, threshold)
-        f['signal'] -= black_level
-        ep = uncertainty.static_error(f, noise, diameter[0], noise_size[0])
-        f = f.join(ep)
-
-    # If this is a pims Frame object, it has a frame number.
-    # Tag it on; this is helpful for parallelization.
-    if hasattr(raw_image, 'frame_no') and raw_image.frame_no is not None:
-        f['frame'] = raw_image.frame_no
-    return f
+    return tuple([max(diam // 2, sep // 2 - 1, sm // 2) for (diam, sep, sm)
+                  in zip(diameter, separation, smoothing_size)])
 
 
 def batch(frames, diameter, minmass=100, maxsize=None, separation=None,
           noise_size=1, smoothing_size=None, threshold=None, invert=False,
           percentile=64, topn=None, preprocess=True, max_iterations=10,
           filter_before=True, filter_after=True,
-          characterize=True, engine='auto',
-          output=None, meta=True):
+          characterize=True, engine='auto', dilation='auto',
+          output=None, meta=True, processes=1, executor=None,
+          noise_interval=1, dtype=None, prefetch=0, profile=False,
+          resume=False, guide_range=None, full_scan_interval=10,
+          as_array=False, max_pending=None):
     """Locate Gaussian-like blobs of some approximate size in a set of images.
 
     Preprocess the image by performing a band pass and a threshold.
@@ -720,13 +1804,87 @@ def batch(frames, diameter, minmass=100, maxsize=None, separation=None,
         features. True by default.
     characterize : boolean
         Compute "extras": eccentricity, signal, ep. True by default.
-    engine : {'auto', 'python', 'numba'}
+    engine : {'auto', 'python', 'numba', 'vectorized'}
+    dilation : {'auto', 'ndimage', 'separable'}
+        Method used to find local maxima. See local_maxima for details.
     output : {None, trackpy.PandasHDFStore, SomeCustomClass}
         If None, return all results as one big DataFrame. Otherwise, pass
         results from each frame, one at a time, to the write() method
         of whatever class is specified here.
     meta : By default, a YAML (plain text) log file is saved in the current
         directory. You can specify a different filepath set False.
+    processes : integer or "auto"
+        Number of worker processes that locate frames in parallel. Default
+        is 1, which locates frames one at a time in this process. If "auto",
+        use one process per CPU core. Results are always returned (or passed
+        to ``output``) in frame order.
+    executor : object, optional
+        Any executor with a ``submit`` method returning futures, such as a
+        ``concurrent.futures.ProcessPoolExecutor`` or a dask ``Client``.
+        If given, frames are distributed through it and ``processes`` is
+        ignored. The executor is not shut down by batch.
+    max_pending : integer, optional
+        With an executor, the most frames submitted to it at once; further
+        frames are read only as results come back. Default is twice the
+        executor's number of workers if it has a ``_max_workers``
+        attribute (as ``concurrent.futures`` executors do), or else twice
+        the number of CPU cores of this machine. Set it for an executor
+        such as a dask ``Client`` whose cluster is larger or smaller.
+    noise_interval : integer
+        Measure the background noise (used for ep) only in every Nth frame,
+        reusing the latest measurement in between. With processes, this is
+        counted per worker process, so which frames are measured depends
+        on how frames are distributed over the workers. It cannot be
+        combined with executor, which may copy the Locator for each frame.
+        Default is 1: every frame.
+    dtype : {None, numpy.float32, numpy.float64}
+        Floating point type used for preprocessing. See locate.
+    prefetch : integer
+        Number of frames to read ahead in a background thread, so that
+        reading and decoding the next frames overlaps with locating the
+        current one. This helps when frames are slow to read, e.g. from a
+        network disk. Default is 0: read each frame when it is needed.
+        The time spent waiting for frames and locating them is reported
+        at the end.
+    profile : boolean
+        Record the wall time of each stage of locating (preprocess, scale,
+        maxima, prefilter, refine, dedup, filter, noise) and the number of
+        candidate features after each stage, for every frame. With the
+        'vectorized' engine, also record the total number of refinement
+        iterations and the number of features that reached max_iterations
+        (otherwise these are 0). If True,
+        return a tuple (features, profile), where profile is a DataFrame
+        with one row per frame. Default False. See Locator.
+    resume : boolean
+        Skip the frames that are already in ``output``, for example to
+        continue after an interrupted run. If frames can be indexed (like a
+        pims reader), the remaining frames are read directly, and the frame
+        at index i is taken to have frame number i, as in pims readers;
+        do not resume this way with a sequence whose frame numbers differ
+        from its indices. Otherwise the done frames are read and passed
+        over, and frames are identified by their frame_no, or else their
+        position. Frames where no features were found are not in the
+        output, so they are located again. Default False.
+    guide_range : number or tuple, optional
+        If given, look for features only within this distance (in pixels,
+        along each axis) of the features found in the previous frame. This
+        saves much work in sparse images. Set it larger than the distance
+        features move between frames. Features that appear elsewhere are
+        found only in a full scan (see full_scan_interval). Guided frames
+        take the percentile threshold of the latest full scan, and they are
+        scaled by the brightest pixel in the windows rather than in the
+        whole frame. So mass, signal and minmass mean the same as in full
+        scans, unless the brightest feature of a frame is a newcomer.
+        Guided locating works frame after frame, so it cannot be combined
+        with processes or executor.
+    full_scan_interval : integer
+        With guide_range, scan the whole frame every Nth frame, to find
+        features that newly appeared. Default 10. Frames after a frame
+        without features are scanned fully too.
+    as_array : boolean
+        Return the features as a structured numpy array, with a field for
+        each column, instead of a DataFrame. Cannot be combined with
+        output. Default False.
 
     See Also
     --------
@@ -759,7 +1917,12 @@ def batch(frames, diameter, minmass=100, maxsize=None, separation=None,
                      noise_size=noise_size, smoothing_size=smoothing_size,
                      invert=invert, percentile=percentile, topn=topn,
                      preprocess=preprocess, max_iterations=max_iterations,
-                     filter_before=filter_before, filter_after=filter_after)
+                     filter_before=filter_before, filter_after=filter_after,
+                     characterize=characterize, engine=engine,
+                     dilation=dilation, noise_interval=noise_interval,
+                     dtype=None if dtype is None else np.dtype(dtype).name,
+                     guide_range=guide_range,
+                     full_scan_interval=full_scan_interval)
 
     if meta:
         if isinstance(meta, str):
@@ -768,30 +1931,276 @@ def batch(frames, diameter, minmass=100, maxsize=None, separation=None,
             filename = 'feature_log_%s.yml' % timestamp
         record_meta(meta_info, filename)
 
+    if as_array and output is not None:
+        raise ValueError("The output takes DataFrames; as_array cannot be "
+                         "used with output.")
+    if executor is not None and noise_interval != 1:
+        raise ValueError("noise_interval > 1 cannot be used with an "
+                         "executor.")
+
+    # Unless the features go to the output, collect them in arrays, which
+    # is lighter than making a DataFrame for every frame. Convert at the end.
+    locator = Locator(diameter, minmass, maxsize, separation, noise_size,
+                      smoothing_size, threshold, invert, percentile, topn,
+                      preprocess, max_iterations, filter_before, filter_after,
+                      characterize, engine, dilation,
+                      noise_interval=noise_interval, dtype=dtype,
+                      profile=profile, as_array=output is None)
+    # Profiles are sent back together with the features, from workers too.
+    locate_func = functools.partial(_profiled, locator) if profile else locator
+
+    frame_nos = None
+    if resume:
+        if output is None:
+            raise ValueError("To resume, give the output that holds the "
+                             "frames already done.")
+        done = set(output.frames)
+        print_update("Resuming: %d frames already done" % len(done))
+        frames, frame_nos = _frames_to_do(frames, done)
+
+    timings = dict(read=0., total=0.)
+    if prefetch:
+        frames = _read_ahead(frames, prefetch)
+    frames = _timed(frames, timings, 'read')
+
+    pool = None
+    if guide_range is not None:
+        if executor is not None or processes != 1:
+            raise ValueError("Guided locating (guide_range) cannot run in "
+                             "parallel.")
+        if (not isinstance(full_scan_interval, six.integer_types) or
+                full_scan_interval < 1):
+            raise ValueError("full_scan_interval must be a positive "
+                             "integer.")
+        located = _locate_guided(locate_func, frames, guide_range,
+                                 full_scan_interval)
+    elif executor is not None:
+        if max_pending is None:
+            # concurrent.futures executors know their size; others (such
+            # as a dask Client) are assumed to be as large as this machine.
+            workers = getattr(executor, '_max_workers', None)
+            max_pending = 2*(workers or multiprocessing.cpu_count())
+        located = _imap_ordered(locate_func, frames, executor.submit,
+                                max_pending=max_pending)
+    elif processes == 1:
+        located = ((image, locate_func(image)) for image in frames)
+    else:
+        if processes == 'auto':
+            processes = multiprocessing.cpu_count()
+        # Give each worker its own Locator, to keep its work buffers.
+        pool = multiprocessing.Pool(processes, _set_worker_locator,
+                                    (locator,))
+        submit = lambda func, image: pool.apply_async(func, (image,))
+        located = _imap_ordered(_worker_locate, frames, submit,
+                                max_pending=2*processes)
+    located = _timed(located, timings, 'total')
+
     all_features = []
+    profiles = []
+    try:
+        for i, (image, features) in enumerate(located):
+            if hasattr(image, 'frame_no') and image.frame_no is not None:
+                frame_no = image.frame_no
+            elif frame_nos is not None:
+                frame_no = frame_nos[i]  # counting, minus the frames done
+            else:
+                frame_no = i  # just counting iterations
+            if profile:
+                features, record = features
+                record['frame'] = frame_no
+                profiles.append(record)
+            # Usually locate has already created this column. Set it here
+            # too, in case the frame number was lost on the way to a worker.
+            features = _set_frame(features, frame_no)
+            message = "Frame %d: %d features" % (frame_no, len(features))
+            print_update(message)
+            if len(features) == 0:
+                continue
+
+            if output is None:
+                all_features.append(features)
+            else:
+                output.put(features)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if prefetch:
+        print_update("%.1f s waiting for frames, %.1f s locating features" %
+                     (timings['read'], timings['total'] - timings['read']))
+
+    if output is None:
+        result = np.concatenate(all_features)
+        if not as_array:
+            result = DataFrame(result)
+    else:
+        result = output
+    if profile:
+        # Stages that were skipped (e.g. when no maxima were found) took
+        # no time.
+        profiles = DataFrame(profiles, columns=PROFILE_COLUMNS).fillna(0)
+        counts = ['frame', 'maxima', 'prefiltered', 'refined', 'features',
+                  'iterations', 'unconverged']
+        profiles[counts] = profiles[counts].astype(np.int64)
+        return result, profiles
+    return result
+
+
+_worker_locator = None
+
+
+def _set_worker_locator(locator):
+    """Initialize a worker process of batch with a Locator."""
+    global _worker_locator
+    _worker_locator = locator
+
+
+def _worker_locate(image):
+    """Locate features in a worker process of batch."""
+    if _worker_locator.profile:
+        return _profiled(_worker_locator, image)
+    return _worker_locator(image)
+
+
+def _profiled(locator, image, **kwargs):
+    """Locate features, returning them together with their profile."""
+    features = locator(image, **kwargs)
+    return features, locator.last_profile
+
+
+def _locate_guided(locate_func, frames, search_range, full_scan_interval):
+    """Locate features in each frame near those of the previous frame,
+    scanning the whole frame every full_scan_interval frames.
+
+    Yields (frame, result) tuples, like _imap_ordered.
+    """
+    previous = None
     for i, image in enumerate(frames):
-        features = locate(image, diameter, minmass, maxsize, separation,
-                          noise_size, smoothing_size, threshold, invert,
-                          percentile, topn, preprocess, max_iterations,
-                          filter_before, filter_after, characterize,
-                          engine)
-        if hasattr(image, 'frame_no') and image.frame_no is not None:
-            frame_no = image.frame_no
-            # If this works, locate created a 'frame' column.
+        if (previous is None or len(previous) == 0 or
+                i % full_scan_interval == 0):
+            result = locate_func(image)
         else:
-            frame_no = i
-            features['frame'] = i  # just counting iterations
-        message = "Frame %d: %d features" % (frame_no, len(features))
-        print_update(message)
-        if len(features) == 0:
-            continue
+            ndim = np.squeeze(image).ndim
+            result = locate_func(image, positions=_positions(previous, ndim),
+                                 search_range=search_range)
+        # When profiling, the result also holds the profile.
+        previous = result[0] if isinstance(result, tuple) else result
+        yield image, result
 
-        if output is None:
-            all_features.append(features)
+
+def _frames_to_do(frames, done):
+    """Leave out the frames whose numbers are in done.
+
+    Returns (frames, frame_nos): the remaining frames, as a generator, and a
+    list of their frame numbers, which is filled as the generator runs.
+    """
+    if hasattr(frames, '__getitem__') and hasattr(frames, '__len__'):
+        # Seek to the remaining frames, without reading the others.
+        frame_nos = [i for i in range(len(frames)) if i not in done]
+        return (frames[i] for i in frame_nos), frame_nos
+    frame_nos = []
+
+    def skip_done():
+        for i, image in enumerate(frames):
+            frame_no = getattr(image, 'frame_no', None)
+            if frame_no is None:
+                frame_no = i
+            if frame_no not in done:
+                frame_nos.append(frame_no)
+                yield image
+    return skip_done(), frame_nos
+
+
+def _timed(iterable, timings, key):
+    """Iterate, adding the time spent waiting for each item to timings[key]."""
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[key] += time.time() - start
+        yield item
+
+
+def _read_ahead(iterable, count):
+    """Iterate over items read in a background thread, up to count ahead.
+
+    Exceptions raised while reading are re-raised in the consuming thread.
+    If the consumer stops early, the reading thread stops too.
+    """
+    queue = six.moves.queue.Queue(count)
+    stopped = threading.Event()
+
+    def put(message):
+        # Wait for room in the queue, unless the consumer has gone away.
+        while not stopped.is_set():
+            try:
+                queue.put(message, timeout=0.1)
+                return True
+            except six.moves.queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception:
+            put((False, sys.exc_info()))
         else:
-            output.put(features)
+            put((False, None))
 
-    if output is None:
-        return pd.concat(all_features).reset_index(drop=True)
-    else:
-        return output
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            ok, item = queue.get()
+            if ok:
+                yield item
+            elif item is None:
+                return
+            else:
+                six.reraise(*item)
+    finally:
+        stopped.set()
+
+
+def _imap_ordered(func, iterable, submit, max_pending):
+    """Apply func to each item using an executor, preserving order.
+
+    Parameters
+    ----------
+    func : callable, taking one item
+    iterable : items, consumed lazily
+    submit : callable
+        submit(func, item) schedules func(item) and returns a future-like
+        object with a result() method (or get(), for multiprocessing).
+    max_pending : integer
+        Maximum number of items in flight. This bounds memory use when the
+        items are large images being read from disk.
+
+    Yields
+    ------
+    (item, result) tuples, in the order of iterable
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append((item, submit(func, item)))
+        if len(pending) >= max_pending:
+            item, future = pending.popleft()
+            yield item, _get_result(future)
+    while pending:
+        item, future = pending.popleft()
+        yield item, _get_result(future)
+
+
+def _get_result(future):
+    """Block until an asynchronous result is ready, and return it."""
+    if hasattr(future, 'result'):
+        return future.result()  # concurrent.futures and friends
+    return future.get()  # multiprocessing.AsyncResult
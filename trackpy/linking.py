@@ -9,7 +9,13 @@ from collections import deque
 
 import numpy as np
 from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 import pandas as pd
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None  # scipy < 0.17
 
 from .utils import print_update
 from .try_numba import try_numba_autojit, NUMBA_AVAILABLE
@@ -429,9 +435,11 @@ def link(levels, search_range, hash_generator, memory=0, track_cls=None,
         then reppear nearby, and be considered the same particle. 0 by default.
     neighbor_strategy : {'BTree', 'KDTree'}
         algorithm used to identify nearby features
-    link_strategy : {'recursive', 'nonrecursive', 'numba', 'drop', 'auto'}
+    link_strategy : {'recursive', 'nonrecursive', 'numba', 'hungarian', 'drop', 'auto'}
         algorithm used to resolve subnetworks of nearby particles
         'auto' uses numba if available
+        'hungarian' solves subnetworks of any size in polynomial time
+        (requires scipy >= 0.17)
         'drop' causes particles in subnetworks to go unlinked
 
     Returns
@@ -470,7 +478,8 @@ def link_df(features, search_range, memory=0,
             predictor=None, adaptive_stop=None, adaptive_step=0.95,
             copy_features=False, diagnostics=False, pos_columns=None,
             t_column=None, hash_size=None, box_size=None,
-            verify_integrity=True, retain_index=False):
+            verify_integrity=True, retain_index=False, engine='python',
+            fallback_strategy=None, executor=None):
     """Link features into trajectories, assigning a label to each trajectory.
 
     Parameters
@@ -488,9 +497,11 @@ def link_df(features, search_range, memory=0,
         then reppear nearby, and be considered the same particle. 0 by default.
     neighbor_strategy : {'KDTree', 'BTree'}
         algorithm used to identify nearby features
-    link_strategy : {'recursive', 'nonrecursive', 'numba', 'drop', 'auto'}
+    link_strategy : {'recursive', 'nonrecursive', 'numba', 'hungarian', 'drop', 'auto'}
         algorithm used to resolve subnetworks of nearby particles
         'auto' uses numba if available
+        'hungarian' solves subnetworks of any size in polynomial time
+        (requires scipy >= 0.17)
         'drop' causes particles in subnetworks to go unlinked
     predictor : function, optional
         Improve performance by guessing where a particle will be in
@@ -503,6 +514,24 @@ def link_df(features, search_range, memory=0,
         becomes <= adaptive_stop, give up and raise a SubnetOversizeException.
     adaptive_step : float, optional
         Reduce search_range by multiplying it by this factor.
+    fallback_strategy : {None, 'hungarian', ...}, optional
+        If not None, the link_strategy for subnets that are too large for
+        link_strategy. This is tried before adaptive search. 'hungarian'
+        solves them in polynomial time.
+    engine : {'python', 'numpy'}
+        'python' (default) represents each feature by a Point object.
+        'numpy' keeps the positions, candidates and track labels in arrays,
+        which is faster and uses much less memory for large data sets.
+        It supports only the 'KDTree' neighbor_strategy, without predictor
+        or diagnostics. Trajectories that begin in the same frame are
+        numbered in the order of their rows.
+    executor : object, optional
+        For the 'numpy' engine only. Any executor with a ``submit`` method
+        returning futures, such as a ``concurrent.futures.ThreadPoolExecutor``
+        or ``ProcessPoolExecutor``. The subnets of each frame
+        are solved in parallel through it, with the same results as without
+        it. Threads help mostly with the 'numba' link_strategy, which
+        releases the GIL. The executor is not shut down.
 
     Returns
     -------
@@ -547,9 +576,29 @@ def link_df(features, search_range, memory=0,
 
     # Group the DataFrame by time steps and make a 'level' out of each
     # one, using the index to keep track of Points.
+    orig_index = None
     if retain_index:
         orig_index = features.index.copy()  # Save it; restore it at the end.
     features.reset_index(inplace=True, drop=True)
+    if engine == 'numpy':
+        linker = ArrayLinker(search_range, memory=memory,
+                             neighbor_strategy=neighbor_strategy,
+                             link_strategy=link_strategy, predictor=predictor,
+                             adaptive_stop=adaptive_stop,
+                             adaptive_step=adaptive_step,
+                             diagnostics=diagnostics,
+                             fallback_strategy=fallback_strategy,
+                             executor=executor)
+        labels = _link_arrays(linker, features, pos_columns, t_column,
+                              verify_integrity)
+        if copy_features:
+            features = features.copy()
+        features['particle'] = labels
+        return _sort_tracks(features, t_column, retain_index, orig_index)
+    elif engine != 'python':
+        raise ValueError("engine must be 'python' or 'numpy'")
+    elif executor is not None:
+        raise ValueError("An executor can only be used with engine='numpy'")
     levels = (_build_level(frame, pos_columns, t_column,
                            diagnostics=diagnostics) for frame_no, frame
               in features.groupby(t_column))
@@ -557,7 +606,8 @@ def link_df(features, search_range, memory=0,
         levels, search_range, memory=memory, predictor=predictor,
         adaptive_stop=adaptive_stop, adaptive_step=adaptive_step,
         neighbor_strategy=neighbor_strategy, link_strategy=link_strategy,
-        hash_size=hash_size, box_size=box_size)
+        hash_size=hash_size, box_size=box_size,
+        fallback_strategy=fallback_strategy)
 
     if diagnostics:
         features = strip_diagnostics(features)  # Makes a copy
@@ -587,6 +637,11 @@ def link_df(features, search_range, memory=0,
         msg = "Frame %d: %d trajectories present" % (frame_no, len(labels))
         print_update(msg)
 
+    return _sort_tracks(features, t_column, retain_index, orig_index)
+
+
+def _sort_tracks(features, t_column, retain_index, orig_index):
+    """Restore the original index, or sort by particle and frame."""
     if retain_index:
         features.index = orig_index
         # And don't bother to sort -- user must be doing something special.
@@ -596,12 +651,37 @@ def link_df(features, search_range, memory=0,
     return features
 
 
+def _link_arrays(linker, features, pos_columns, t_column, verify_integrity):
+    """Link all the features of a DataFrame with an ArrayLinker.
+
+    Returns the track labels (as floats), in the order of the rows.
+    """
+    t = features[t_column].values
+    order = np.argsort(t, kind='mergesort')  # stable: keeps order in frames
+    t = t[order]
+    coords = features[pos_columns].values[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(t)) + 1])
+    stops = np.append(starts[1:], len(t))
+    levels = (coords[start:stop] for start, stop in zip(starts, stops))
+
+    labels = np.empty(len(t), dtype=np.float64)
+    for start, stop, tracks in zip(starts, stops, linker.link(levels)):
+        frame_no = t[start]
+        if verify_integrity:
+            _verify_integrity(frame_no, tracks)
+        labels[order[start:stop]] = tracks
+        msg = "Frame %d: %d trajectories present" % (frame_no, len(tracks))
+        print_update(msg)
+    return labels
+
+
 def link_df_iter(features, search_range, memory=0,
             neighbor_strategy='KDTree', link_strategy='auto',
             predictor=None, adaptive_stop=None, adaptive_step=0.95,
             diagnostics=False, pos_columns=None,
             t_column=None, hash_size=None, box_size=None,
-            verify_integrity=True, retain_index=False):
+            verify_integrity=True, retain_index=False, engine='python',
+            fallback_strategy=None, executor=None):
     """Link features into trajectories, assigning a label to each trajectory.
 
     Parameters
@@ -619,9 +699,11 @@ def link_df_iter(features, search_range, memory=0,
     neighbor_strategy : {'KDTree', 'BTree'}
         algorithm used to identify nearby features. Note that when using
         BTree, you must specify hash_size
-    link_strategy : {'recursive', 'nonrecursive', 'numba', 'drop', 'auto'}
+    link_strategy : {'recursive', 'nonrecursive', 'numba', 'hungarian', 'drop', 'auto'}
         algorithm used to resolve subnetworks of nearby particles
         'auto' uses numba if available
+        'hungarian' solves subnetworks of any size in polynomial time
+        (requires scipy >= 0.17)
         'drop' causes particles in subnetworks to go unlinked
     predictor : function, optional
         Improve performance by guessing where a particle will be in the
@@ -634,6 +716,24 @@ def link_df_iter(features, search_range, memory=0,
         becomes <= adaptive_stop, give up and raise a SubnetOversizeException.
     adaptive_step : float, optional
         Reduce search_range by multiplying it by this factor.
+    fallback_strategy : {None, 'hungarian', ...}, optional
+        If not None, the link_strategy for subnets that are too large for
+        link_strategy. This is tried before adaptive search. 'hungarian'
+        solves them in polynomial time.
+    engine : {'python', 'numpy'}
+        'python' (default) represents each feature by a Point object.
+        'numpy' keeps the positions, candidates and track labels in arrays,
+        which is faster and uses much less memory for large data sets.
+        It supports only the 'KDTree' neighbor_strategy, without predictor
+        or diagnostics. Trajectories that begin in the same frame are
+        numbered in the order of their rows.
+    executor : object, optional
+        For the 'numpy' engine only. Any executor with a ``submit`` method
+        returning futures, such as a ``concurrent.futures.ThreadPoolExecutor``
+        or ``ProcessPoolExecutor``. The subnets of each frame
+        are solved in parallel through it, with the same results as without
+        it. Threads help mostly with the 'numba' link_strategy, which
+        releases the GIL. The executor is not shut down.
 
     Returns
     -------
@@ -679,16 +779,35 @@ def link_df_iter(features, search_range, memory=0,
     # To allow extra columns to be recovered later
     features_forlinking, features_forpost = itertools.tee(
         (frame.reset_index(drop=True) for frame in features_for_reset))
-    # make a generator over the frames
-    levels = (_build_level(frame, pos_columns, t_column, diagnostics=diagnostics)
-                         for frame in features_forlinking)
-
-    # make a generator of the levels post-linking
-    labeled_levels = link_iter(
-        levels, search_range, memory=memory, predictor=predictor,
-        adaptive_stop=adaptive_stop, adaptive_step=adaptive_step,
-        neighbor_strategy=neighbor_strategy, link_strategy=link_strategy,
-        hash_size=hash_size, box_size=box_size)
+    if engine == 'numpy':
+        linker = ArrayLinker(search_range, memory=memory,
+                             neighbor_strategy=neighbor_strategy,
+                             link_strategy=link_strategy, predictor=predictor,
+                             adaptive_stop=adaptive_stop,
+                             adaptive_step=adaptive_step,
+                             diagnostics=diagnostics,
+                             fallback_strategy=fallback_strategy,
+                             executor=executor)
+        labeled_levels = linker.link(frame[pos_columns].values
+                                     for frame in features_forlinking)
+    elif engine == 'python':
+        if executor is not None:
+            raise ValueError("An executor can only be used with "
+                             "engine='numpy'")
+        # make a generator over the frames
+        levels = (_build_level(frame, pos_columns, t_column,
+                               diagnostics=diagnostics)
+                  for frame in features_forlinking)
+
+        # make a generator of the levels post-linking
+        labeled_levels = link_iter(
+            levels, search_range, memory=memory, predictor=predictor,
+            adaptive_stop=adaptive_stop, adaptive_step=adaptive_step,
+            neighbor_strategy=neighbor_strategy, link_strategy=link_strategy,
+            hash_size=hash_size, box_size=box_size,
+            fallback_strategy=fallback_strategy)
+    else:
+        raise ValueError("engine must be 'python' or 'numpy'")
 
     # Re-assemble the features data, now with track labels and (if desired)
     # the original index.
@@ -696,10 +815,14 @@ def link_df_iter(features, search_range, memory=0,
             labeled_levels, features_forpost, index_iter):
         features = source_features.copy()
         features['particle'] = np.nan  # placeholder
-        index = [x.id for x in labeled_level]
-        labels = pd.Series([x.track.id for x in labeled_level], index)
-        # uses an arbitary element from the set
-        frame_no = next(iter(labeled_level)).t
+        if engine == 'numpy':
+            labels = pd.Series(labeled_level, features.index)
+            frame_no = features[t_column].values[0]
+        else:
+            index = [x.id for x in labeled_level]
+            labels = pd.Series([x.track.id for x in labeled_level], index)
+            # uses an arbitary element from the set
+            frame_no = next(iter(labeled_level)).t
         if verify_integrity:
             # This checks that the labeling is sane and tries
             # to raise informatively if some unknown bug in linking
@@ -778,7 +901,8 @@ class UnknownLinkingError(Exception):
 
 
 def _verify_integrity(frame_no, labels):
-    if labels.duplicated().sum() > 0:
+    labels = np.asarray(labels)
+    if len(np.unique(labels)) < len(labels):
         raise UnknownLinkingError(
             "There are two particles with the same label in Frame %d.".format(
                 frame_no))
@@ -791,7 +915,7 @@ def link_iter(levels, search_range, memory=0,
               neighbor_strategy='KDTree', link_strategy='auto',
               hash_size=None, box_size=None, predictor=None,
               adaptive_stop=None, adaptive_step=0.95,
-              track_cls=None, hash_generator=None):
+              track_cls=None, hash_generator=None, fallback_strategy=None):
     """Link features into trajectories, assigning a label to each trajectory.
 
     This function is a generator which yields at each step the Point
@@ -809,9 +933,11 @@ def link_iter(levels, search_range, memory=0,
         then reppear nearby, and be considered the same particle. 0 by default.
     neighbor_strategy : {'KDTree', 'BTree'}
         algorithm used to identify nearby features
-    link_strategy : {'recursive', 'nonrecursive', 'numba', 'drop', 'auto'}
+    link_strategy : {'recursive', 'nonrecursive', 'numba', 'hungarian', 'drop', 'auto'}
         algorithm used to resolve subnetworks of nearby particles
         'auto' uses numba if available
+        'hungarian' solves subnetworks of any size in polynomial time
+        (requires scipy >= 0.17)
         'drop' causes particles in subnetworks to go unlinked
     predictor : function, optional
         Improve performance by guessing where a particle will be in the
@@ -823,6 +949,10 @@ def link_iter(levels, search_range, memory=0,
         becomes <= adaptive_stop, give up and raise a SubnetOversizeException.
     adaptive_step : float, optional
         Reduce search_range by multiplying it by this factor.
+    fallback_strategy : {None, 'hungarian', ...}, optional
+        If not None, the link_strategy for subnets that are too large for
+        link_strategy. This is tried before adaptive search. 'hungarian'
+        solves them in polynomial time.
 
     Returns
     -------
@@ -849,7 +979,8 @@ def link_iter(levels, search_range, memory=0,
                  link_strategy=link_strategy, hash_size=hash_size,
                  box_size=box_size, predictor=predictor,
                  adaptive_stop=adaptive_stop, adaptive_step=adaptive_step,
-                 track_cls=track_cls, hash_generator=hash_generator)
+                 track_cls=track_cls, hash_generator=hash_generator,
+                 fallback_strategy=fallback_strategy)
     return linker.link(levels)
 
 class Linker(object):
@@ -863,7 +994,7 @@ class Linker(object):
               neighbor_strategy='KDTree', link_strategy='auto',
               hash_size=None, box_size=None, predictor=None,
               adaptive_stop=None, adaptive_step=0.95,
-              track_cls=None, hash_generator=None):
+              track_cls=None, hash_generator=None, fallback_strategy=None):
         self.search_range = search_range
         self.memory = memory
         self.predictor = predictor
@@ -885,32 +1016,15 @@ class Linker(object):
         if self.track_cls is None:
             self.track_cls = TrackUnstored  # does not store Points
 
-        linkers = {'recursive': recursive_linker_obj,
-                   'nonrecursive': nonrecursive_link,
-                   'drop': drop_link}
-        if NUMBA_AVAILABLE:
-            linkers['numba'] = numba_link
-            linkers['auto'] = linkers['numba']
-        else:
-            linkers['auto'] = linkers['recursive']
-        try:
-            self.subnet_linker = linkers[link_strategy]
-        except KeyError:
-            raise ValueError("link_strategy must be one of: " + ', '.join(linkers.keys()))
+        self.subnet_linker = _get_subnet_linker(link_strategy)
+        self.fallback_linker = None
+        if fallback_strategy is not None:
+            self.fallback_linker = _get_subnet_linker(fallback_strategy)
 
         if self.neighbor_strategy not in ['KDTree', 'BTree']:
             raise ValueError("neighbor_strategy must be 'KDTree' or 'BTree'")
 
-        if self.adaptive_stop is not None:
-            if 1 * self.adaptive_stop <= 0:
-                raise ValueError("adaptive_stop must be positive.")
-            self.max_subnet_size = self.MAX_SUB_NET_SIZE_ADAPTIVE
-        else:
-            self.max_subnet_size = self.MAX_SUB_NET_SIZE
-
-        if 1 * self.adaptive_step <= 0 or 1 * self.adaptive_step >= 1:
-            raise ValueError("adaptive_step must be between "
-                             "0 and 1 non-inclusive.")
+        self.max_subnet_size = _check_adaptive(self)
 
         self.subnet_counter = 0  # Unique ID for each subnet
 
@@ -987,18 +1101,23 @@ class Linker(object):
                 p.back_cands = []
                 p.forward_cands = []
 
-            # Sort out what can go to what.
-            assign_candidates(cur_level, prev_hash, self.search_range,
-                              self.neighbor_strategy)
-
-            # sort the candidate lists by distance
-            for p in cur_set:
-                p.back_cands.sort(key=lambda x: x[1])
-            for p in prev_set:
-                p.forward_cands.sort(key=lambda x: x[1])
+            # Sort out what can go to what. Particles that are each
+            # other's only candidate are linked right away.
+            spl, dpl = assign_candidates(cur_level, prev_hash,
+                                         self.search_range,
+                                         self.neighbor_strategy,
+                                         simple_links=True)
+            cur_set.difference_update(dpl)
+            prev_set.difference_update(spl)
+            if self.diag:
+                for dp in dpl:
+                    dp.diag['search_range'] = self.search_range
 
             # Note that this modifies cur_set, prev_set, but that's OK.
-            spl, dpl = self._assign_links(cur_set, prev_set, self.search_range)
+            sn_spl, sn_dpl = self._assign_links(cur_set, prev_set,
+                                                self.search_range)
+            spl.extend(sn_spl)
+            dpl.extend(sn_dpl)
 
             new_mem_set = set()
             for sp, dp in zip(spl, dpl):
@@ -1123,9 +1242,9 @@ class Linker(object):
                 _s.forward_cands.append((None, search_range))
 
             try:
-                sn_spl, sn_dpl = self.subnet_linker(s_sn, len(d_sn), search_range,
-                                                    max_size=self.max_subnet_size,
-                                                    diag=diag)
+                sn_spl, sn_dpl = _link_subnet(
+                    self.subnet_linker, self.fallback_linker, s_sn,
+                    len(d_sn), search_range, self.max_subnet_size, diag=diag)
 
                 if diag:
                     # Record information about this invocation of the subnet linker.
@@ -1169,9 +1288,401 @@ class Linker(object):
         return spl, dpl
 
 
-def assign_candidates(cur_level, prev_hash, search_range, neighbor_strategy):
+class ArrayLinker(object):
+    """Link features that are given as arrays of coordinates.
+
+    This is the linker behind ``engine='numpy'``. Instead of a Point object
+    for each feature, it keeps the positions, the candidate links and the
+    track labels of a frame in arrays. Only the particles in subnets are
+    handed, briefly, to the subnet linkers as objects. The results are the
+    same as Linker's, except that tracks that begin in the same frame are
+    numbered in the order of the features. See link_iter() and link_df()
+    for a description of parameters.
+    """
+    MAX_SUB_NET_SIZE = Linker.MAX_SUB_NET_SIZE
+    MAX_SUB_NET_SIZE_ADAPTIVE = Linker.MAX_SUB_NET_SIZE_ADAPTIVE
+    # Number of source features in the subnets given to the executor at once.
+    PARALLEL_CHUNK_SIZE = 200
+
+    def __init__(self, search_range, memory=0,
+                 neighbor_strategy='KDTree', link_strategy='auto',
+                 predictor=None, adaptive_stop=None, adaptive_step=0.95,
+                 diagnostics=False, fallback_strategy=None, executor=None):
+        if neighbor_strategy != 'KDTree':
+            raise ValueError("The 'numpy' engine supports only the 'KDTree' "
+                             "neighbor_strategy")
+        if predictor is not None:
+            raise NotImplementedError(
+                "Prediction is not available in the 'numpy' engine.")
+        if diagnostics:
+            raise NotImplementedError(
+                "Diagnostics are not available in the 'numpy' engine.")
+        self.search_range = search_range
+        self.memory = memory
+        self.adaptive_stop = adaptive_stop
+        self.adaptive_step = adaptive_step
+        self.executor = executor
+        self.subnet_linker = _get_subnet_linker(link_strategy)
+        self.fallback_linker = None
+        if fallback_strategy is not None:
+            self.fallback_linker = _get_subnet_linker(fallback_strategy)
+        self.max_subnet_size = _check_adaptive(self)
+
+    def link(self, levels):
+        """Link levels (N x d arrays of coordinates) into trajectories.
+
+        This is a generator, which yields the track label of each feature
+        of each level, in order.
+        """
+        level_iter = iter(levels)
+        coords = np.asarray(next(level_iter))
+        tracks = np.arange(len(coords), dtype=np.int64)
+        track_count = len(coords)
+        yield tracks
+
+        # The source features of each step are the features of the previous
+        # level, followed by the remembered ones. The step in which a
+        # feature was lost is -1 for features of the previous level.
+        source_coords, source_tracks = coords, tracks
+        source_lost = -np.ones(len(coords), dtype=np.int64)
+        for step, coords in enumerate(level_iter, 1):
+            coords = np.asarray(coords)
+            if len(source_coords) > 0:
+                source, dest, dists = _kdtree_candidates(
+                    cKDTree(source_coords, 15), coords, self.search_range)
+            else:
+                source = dest = np.empty(0, dtype=np.intp)
+                dists = np.empty(0, dtype=np.float64)
+            match = self._assign_links(len(source_coords), len(coords),
+                                       source, dest, dists, self.search_range)
+
+            linked = match >= 0
+            tracks = np.empty(len(coords), dtype=np.int64)
+            tracks[linked] = source_tracks[match[linked]]
+            new_count = len(coords) - np.count_nonzero(linked)
+            tracks[~linked] = np.arange(track_count, track_count + new_count)
+            track_count += new_count
+
+            if self.memory > 0:
+                lost = np.ones(len(source_coords), dtype=bool)
+                lost[match[linked]] = False
+                lost_at = source_lost[lost]
+                lost_at[lost_at < 0] = step
+                remember = step - lost_at < self.memory
+                source_coords = np.concatenate(
+                    [coords, source_coords[lost][remember]])
+                source_tracks = np.concatenate(
+                    [tracks, source_tracks[lost][remember]])
+                source_lost = np.concatenate(
+                    [-np.ones(len(coords), dtype=np.int64),
+                     lost_at[remember]])
+            else:
+                source_coords, source_tracks = coords, tracks
+                source_lost = -np.ones(len(coords), dtype=np.int64)
+            yield tracks
+
+    def _assign_links(self, source_count, dest_count, source, dest, dists,
+                      search_range):
+        """Match destination with source features.
+
+        The candidate links are given by arrays of source and destination
+        indices, and their distances. Returns the index of the source
+        feature linked to each destination feature, or -1.
+        """
+        match = -np.ones(dest_count, dtype=np.intp)
+        simple = _simple_links(source, dest)
+        match[dest[simple]] = source[simple]
+        if np.all(simple):
+            return match
+
+        # Group the remaining features into subnets, which are networks of
+        # features that share candidates.
+        subnet = ~simple
+        source, dest, dists = source[subnet], dest[subnet], dists[subnet]
+        node_count = source_count + dest_count
+        graph = coo_matrix((np.ones(len(source)), (source, source_count + dest)),
+                           shape=(node_count, node_count))
+        _, net = connected_components(graph, directed=False)
+        link_net = net[source]
+
+        # Sort the links by subnet, then by source, then by distance.
+        # Subnets are small, so plain lists are faster than arrays from
+        # here on.
+        order = np.lexsort((dists, source, link_net))
+        source = source[order].tolist()
+        dest = dest[order].tolist()
+        dists = dists[order].tolist()
+        bounds = np.flatnonzero(np.diff(link_net[order])) + 1
+        bounds = [0] + bounds.tolist() + [len(source)]
+        subnets = ((start, stop) + _subnet_candidates(
+                       source[start:stop], dest[start:stop],
+                       dists[start:stop], search_range)
+                   for start, stop in zip(bounds[:-1], bounds[1:]))
+
+        for subnet, result in self._link_subnets(subnets, search_range):
+            start, stop, sources, dests, _ = subnet
+            if isinstance(result, SubnetOversizeException):
+                self._assign_oversize(
+                    source[start:stop], dest[start:stop], dists[start:stop],
+                    sources, dests, search_range, match, result)
+                continue
+            for j, i in result:
+                match[dests[i]] = sources[j]
+        return match
+
+    def _link_subnets(self, subnets, search_range):
+        """Solve subnets, given as (start, stop, sources, dests, cands)
+        tuples, where the last three are made by _subnet_candidates().
+
+        This is a generator, which yields each subnet with its result from
+        _link_subnets_worker(), in order. Without an executor, the subnets
+        are solved one by one as they come. With an executor, they are all
+        collected first and solved in parallel.
+        """
+        args = (self.subnet_linker, self.fallback_linker,
+                self.max_subnet_size)
+        if self.executor is None:
+            for subnet in subnets:
+                cands, dest_count = subnet[4], len(subnet[3])
+                yield subnet, _link_subnets_worker(
+                    args, [(cands, dest_count)], search_range)[0]
+            return
+
+        # Send the subnets in chunks, to save overhead for small ones.
+        chunks, chunk, chunk_size = [], [], 0
+        for subnet in subnets:
+            chunk.append(subnet)
+            chunk_size += len(subnet[2])
+            if chunk_size >= self.PARALLEL_CHUNK_SIZE:
+                chunks.append(chunk)
+                chunk, chunk_size = [], 0
+        if chunk:
+            chunks.append(chunk)
+        futures = [self.executor.submit(
+                       _link_subnets_worker, args,
+                       [(subnet[4], len(subnet[3])) for subnet in chunk],
+                       search_range)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            for subnet, result in zip(chunk, future.result()):
+                yield subnet, result
+
+    def _assign_oversize(self, source, dest, dists, sources, dests,
+                         search_range, match, error):
+        """Link a subnet that was too large for the subnet linker, using
+        adaptive search, and record the links in ``match``.
+
+        The links of the subnet are given as lists, sorted by source
+        and distance.
+        """
+        if self.adaptive_stop is None:
+            raise error
+        # Reduce search_range
+        new_range = search_range * self.adaptive_step
+        if search_range <= self.adaptive_stop:
+            # adaptive_stop is the search_range below which linking
+            # is presumed invalid. So we just give up.
+            raise error
+        dists = np.array(dists)
+        keep = dists <= new_range
+        dest_map = dict((i, k) for k, i in enumerate(dests))
+        source = np.searchsorted(sources, source)[keep]
+        dest = np.array([dest_map[i] for i in dest], dtype=np.intp)[keep]
+        sn_match = self._assign_links(len(sources), len(dests),
+                                      source, dest, dists[keep], new_range)
+        linked = np.flatnonzero(sn_match >= 0)
+        match[np.take(dests, linked)] = np.take(sources, sn_match[linked])
+
+
+class _SubnetSource(object):
+    """Stands in for a source Point when an ArrayLinker solves a subnet.
+
+    Its forward candidates are (destination index, distance) pairs.
+    """
+    __slots__ = ['index', 'forward_cands']
+
+    def __init__(self, index, forward_cands):
+        self.index = index
+        self.forward_cands = forward_cands
+
+
+def _subnet_candidates(source, dest, dists, search_range):
+    """Number the features of a subnet, whose links are given as lists
+    sorted by source and distance.
+
+    Returns the source and destination indices of the features, and the
+    forward candidates of each source as (destination number, distance)
+    pairs, ending with the penalty for not linking.
+    """
+    sources, dests, dest_map, cands = [], [], {}, []
+    for j, i, dist in zip(source, dest, dists):
+        if not sources or sources[-1] != j:
+            sources.append(j)
+            cands.append([])
+        if i not in dest_map:
+            dest_map[i] = len(dests)
+            dests.append(i)
+        cands[-1].append((dest_map[i], dist))
+    # add in penalty for not linking
+    for fc in cands:
+        fc.append((None, search_range))
+    return sources, dests, cands
+
+
+def _link_subnets_worker(args, subnets, search_range):
+    """Solve subnets given as (candidates, destination count) pairs.
+
+    ``args`` are the subnet linker, fallback linker and maximum subnet size.
+    Returns, for each subnet, the linked (source number, destination
+    number) pairs, or the SubnetOversizeException that was raised. Only
+    plain data go in and out, so that this can run in another thread or
+    process.
+    """
+    subnet_linker, fallback_linker, max_size = args
+    results = []
+    for cands, dest_size in subnets:
+        source_list = [_SubnetSource(j, fc) for j, fc in enumerate(cands)]
+        try:
+            sn_spl, sn_dpl = _link_subnet(subnet_linker, fallback_linker,
+                                          source_list, dest_size,
+                                          search_range, max_size)
+        except SubnetOversizeException as error:
+            results.append(error)
+            continue
+        results.append([(sp.index, dp) for sp, dp in zip(sn_spl, sn_dpl)
+                        if sp is not None and dp is not None])
+    return results
+
+
+def _get_subnet_linker(link_strategy):
+    """Return the subnet linker function for a link_strategy."""
+    linkers = {'recursive': recursive_linker_obj,
+               'nonrecursive': nonrecursive_link,
+               'drop': drop_link}
+    if linear_sum_assignment is not None:
+        linkers['hungarian'] = hungarian_link
+    if NUMBA_AVAILABLE:
+        linkers['numba'] = numba_link
+        linkers['auto'] = linkers['numba']
+    else:
+        linkers['auto'] = linkers['recursive']
+    try:
+        return linkers[link_strategy]
+    except KeyError:
+        raise ValueError("link_strategy must be one of: " + ', '.join(linkers.keys()))
+
+
+def _link_subnet(subnet_linker, fallback_linker, source_list, dest_size,
+                 search_range, max_size, diag=False):
+    """Solve a subnet with a subnet linker.
+
+    If the subnet is too large, try the fallback linker, if there is one.
+    """
+    try:
+        return subnet_linker(source_list, dest_size, search_range,
+                             max_size=max_size, diag=diag)
+    except SubnetOversizeException:
+        if fallback_linker is None:
+            raise
+        return fallback_linker(source_list, dest_size, search_range,
+                               max_size=max_size, diag=diag)
+
+
+def _check_adaptive(linker):
+    """Validate the adaptive search parameters of a linker.
+
+    Returns the largest subnet the linker should attempt to solve."""
+    if linker.adaptive_stop is not None:
+        if 1 * linker.adaptive_stop <= 0:
+            raise ValueError("adaptive_stop must be positive.")
+        max_subnet_size = linker.MAX_SUB_NET_SIZE_ADAPTIVE
+    else:
+        max_subnet_size = linker.MAX_SUB_NET_SIZE
+
+    if 1 * linker.adaptive_step <= 0 or 1 * linker.adaptive_step >= 1:
+        raise ValueError("adaptive_step must be between "
+                         "0 and 1 non-inclusive.")
+    return max_subnet_size
+
+
+def _kdtree_candidates(kdtree, dest_coords, search_range):
+    """Find the candidate links from the features in a KDTree (the sources)
+    to the features at dest_coords.
+
+    Returns arrays of the source and destination index of each candidate
+    link, and its distance. The links are ordered by destination, then by
+    distance, like a CSR matrix.
+    """
+    dest_coords = np.asarray(dest_coords, dtype=np.float64)
+    source_count = kdtree.n
+    if len(dest_coords) == 0 or source_count == 0:
+        return (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp),
+                np.empty(0, dtype=np.float64))
+    dest_coords = dest_coords.reshape(len(dest_coords), -1)
+
+    # Guess the number of neighbors to ask for from the mean density of
+    # features. Features that have that many neighbors in range may have
+    # more; ask again for them, with twice as many.
+    extent = np.maximum(dest_coords.max(0) - dest_coords.min(0),
+                        2 * search_range)
+    expected = source_count * np.prod(2 * search_range / extent)
+    k = int(min(2 * expected + 2, source_count))
+
+    dest_index = np.arange(len(dest_coords))
+    sources, dests, dists = [], [], []
+    while True:
+        d, inds = kdtree.query(dest_coords[dest_index], k,
+                               distance_upper_bound=search_range)
+        d = d.reshape(len(dest_index), k)
+        inds = inds.reshape(len(dest_index), k)
+        found = np.isfinite(d)
+        if k < source_count:
+            full = found[:, -1].copy()
+            found[full] = False
+        else:
+            full = np.zeros(len(dest_index), dtype=bool)
+        sources.append(inds[found])
+        dests.append(np.repeat(dest_index, found.sum(1)))
+        dists.append(d[found])
+        if not np.any(full):
+            break
+        dest_index = dest_index[full]
+        k = min(2 * k, source_count)
+
+    source, dest, dists = [np.concatenate(a) for a in (sources, dests, dists)]
+    if len(sources) > 1:
+        order = np.argsort(dest, kind='mergesort')
+        source, dest, dists = source[order], dest[order], dists[order]
+    return source, dest, dists
+
+
+def _simple_links(source, dest):
+    """Find the candidate links that are the only candidate of both their
+    source and their destination.
+
+    The links are given by arrays of source and destination indices.
+    Returns a boolean mask.
+    """
+    if len(source) == 0:
+        return np.zeros(0, dtype=bool)
+    return ((np.bincount(source)[source] == 1) &
+            (np.bincount(dest)[dest] == 1))
+
+
+def assign_candidates(cur_level, prev_hash, search_range, neighbor_strategy,
+                      simple_links=False):
+    """Record the candidate links between the particles in cur_level and
+    prev_hash, in their back_cands and forward_cands, nearest first.
+
+    If ``simple_links`` is True, links between a particle and a source
+    that have no other candidates are found in bulk ('KDTree' only). They
+    are not recorded, but returned as lists of source and destination
+    particles.
+    """
+    spl, dpl = [], []
     if neighbor_strategy == 'BTree':
         # (Tom's code)
+        prev_points = set()
         for p in cur_level:
             work_box = prev_hash.get_region(p, search_range)
             for wp in work_box:
@@ -1179,16 +1690,34 @@ def assign_candidates(cur_level, prev_hash, search_range, neighbor_strategy):
                 if d < search_range:
                     p.back_cands.append((wp, d))
                     wp.forward_cands.append((p, d))
+                    prev_points.add(wp)
+        # sort the candidate lists by distance
+        for p in cur_level:
+            p.back_cands.sort(key=lambda x: x[1])
+        for p in prev_points:
+            p.forward_cands.sort(key=lambda x: x[1])
     elif neighbor_strategy == 'KDTree':
         hashpts = prev_hash.points
+        cur_level = list(cur_level)
         cur_coords = np.array([x.pos for x in cur_level])
-        dists, inds = prev_hash.kdtree.query(cur_coords, 10, distance_upper_bound=search_range)
-        nn = np.sum(np.isfinite(dists), 1)  # Number of neighbors of each particle
-        for i, p in enumerate(cur_level):
-            for j in range(nn[i]):
-                wp = hashpts[inds[i, j]]
-                p.back_cands.append((wp, dists[i, j]))
-                wp.forward_cands.append((p, dists[i, j]))
+        source, dest, dists = _kdtree_candidates(prev_hash.kdtree, cur_coords,
+                                                 search_range)
+        if simple_links:
+            simple = _simple_links(source, dest)
+            spl = [hashpts[j] for j in source[simple]]
+            dpl = [cur_level[i] for i in dest[simple]]
+            subnet = ~simple
+            source, dest, dists = source[subnet], dest[subnet], dists[subnet]
+        # The links are sorted by destination and distance. Sort them by
+        # source and distance, too, for the forward candidates.
+        order = np.lexsort((dists, source))
+        dest, source, dists = dest.tolist(), source.tolist(), dists.tolist()
+        for i, j, dist in zip(dest, source, dists):
+            cur_level[i].back_cands.append((hashpts[j], dist))
+        for k in order.tolist():
+            hashpts[source[k]].forward_cands.append((cur_level[dest[k]],
+                                                     dists[k]))
+    return spl, dpl
 
 
 class SubnetOversizeException(Exception):
@@ -1417,7 +1946,7 @@ def numba_link(s_sn, dest_size, search_range, max_size=30, diag=False):
     dest_results = [dcands[i] if i >= 0 else None for i in best_assignments]
     return source_results, dest_results
 
-@try_numba_autojit(nopython=True)
+@try_numba_autojit(nopython=True, nogil=True)
 def _numba_subnet_norecur(ncands, candsarray, dists2array, cur_assignments,
                           cur_sums, tmp_assignments, best_assignments):
     """Find the optimal track assigments for a subnetwork, without recursion.
@@ -1509,6 +2038,48 @@ def _numba_subnet_norecur(ncands, candsarray, dists2array, cur_assignments,
             tmp_assignments[j] += 1
 
 
+def hungarian_link(source_list, dest_size, search_range, max_size=30,
+                   diag=False):
+    """Solve a subnet as a linear assignment problem.
+
+    This is an alternate "link_strategy", selected by specifying
+    'hungarian'. Like the other subnet linkers, it minimizes the sum of the
+    squared distances of the links, plus ``search_range**2`` for each
+    source particle that is not linked. The optimal links are found by
+    ``scipy.optimize.linear_sum_assignment`` in polynomial time, so there
+    is no limit on the size of the subnet; ``max_size`` is ignored.
+
+    The cost matrix has a column for each destination particle, and a
+    column for not linking each source particle.
+    """
+    source_list = list(source_list)
+    dests, dest_map = [], {}
+    for sp in source_list:
+        for dp, dist in sp.forward_cands:
+            if dp is not None and dp not in dest_map:
+                dest_map[dp] = len(dests)
+                dests.append(dp)
+
+    nj, ni = len(source_list), len(dests)
+    penalty = search_range**2
+    # Leaving every source particle unlinked costs at most nj * penalty.
+    # Any assignment that uses a forbidden element costs more than that.
+    cost = np.empty((nj, ni + nj), dtype=np.float64)
+    cost.fill(penalty * (nj + 1))
+    for j, sp in enumerate(source_list):
+        for dp, dist in sp.forward_cands:
+            if dp is not None:
+                cost[j, dest_map[dp]] = dist**2
+        cost[j, ni + j] = penalty
+
+    rows, cols = linear_sum_assignment(cost)
+    dest_results = [None] * nj
+    for j, i in zip(rows, cols):
+        if i < ni:
+            dest_results[j] = dests[i]
+    return source_list, dest_results
+
+
 def drop_link(source_list, dest_size, search_range, max_size=30, diag=False):
     """Handle subnets by dropping particles.
 
@@ -1,43 +1,121 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
+import multiprocessing
+
 import numpy as np
-from scipy.ndimage.filters import uniform_filter1d
+from scipy.ndimage.filters import uniform_filter1d, gaussian_filter1d
 from scipy.ndimage.fourier import fourier_gaussian
 
 from .utils import print_update, validate_tuple
 
 
-# When loading module, try to use pyFFTW ("Fastest Fourier Transform in the
-# West") if it is available.
+# When loading module, find the available FFT implementations. By default,
+# use pyFFTW ("Fastest Fourier Transform in the West") if it is available,
+# then scipy.fft (scipy >= 1.4), then numpy.
+FFT_BACKENDS = ['numpy']
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    pass
+else:
+    FFT_BACKENDS.insert(0, 'scipy')
 try:
     import pyfftw
 except ImportError:
-    # Use numpy.
-    USING_FFTW = False
-    fftn = np.fft.fftn
-    ifftn = np.fft.ifftn
+    pass
 else:
-    USING_FFTW = True
-    pyfftw.interfaces.cache.enable()
+    FFT_BACKENDS.insert(0, 'pyfftw')
+    pyfftw.interfaces.cache.enable()  # reuse plans between calls
     planned = False
 
-    def fftn(a):
+# Stacks of images are bandpassed in chunks of about this many pixels.
+STACK_CHUNK_SIZE = 2**22
+
+# Constants for choosing between a Gaussian in real space or Fourier space.
+# Costs are estimated in units of one multiply-add per pixel; see
+# gaussian_method.
+GAUSSIAN_TRUNCATE = 4.0  # truncate the real-space kernel at this many sigma
+GAUSSIAN_PASS_COST = 6  # overhead of each real-space pass
+FFT_COST = 2.5  # per pixel and per factor of two in image size
+
+FFT_BACKEND = FFT_BACKENDS[0]
+FFT_WORKERS = 1
+USING_FFTW = FFT_BACKEND == 'pyfftw'
+
+
+def set_fft_backend(backend='auto', workers=1):
+    """Choose the FFT implementation used by bandpass.
+
+    Parameters
+    ----------
+    backend : {'auto', 'pyfftw', 'scipy', 'numpy'}
+        'auto' (default) uses the first of these that is installed. 'scipy'
+        requires scipy.fft, which is new in scipy 1.4.
+    workers : integer
+        Number of threads used for each transform, if the backend supports
+        it (pyfftw and scipy do). Negative values count back from the number
+        of CPU cores: -1 uses all of them. Default is 1.
+    """
+    global FFT_BACKEND, FFT_WORKERS, USING_FFTW
+    if backend == 'auto':
+        backend = FFT_BACKENDS[0]
+    if backend not in FFT_BACKENDS:
+        raise ValueError("FFT backend '{0}' is not available. Available "
+                         "backends are {1}".format(backend, FFT_BACKENDS))
+    workers = int(workers)
+    if workers < 0:
+        workers = max(multiprocessing.cpu_count() + 1 + workers, 1)
+    elif workers == 0:
+        raise ValueError("workers must be nonzero")
+    FFT_BACKEND = backend
+    FFT_WORKERS = workers
+    USING_FFTW = backend == 'pyfftw'
+
+
+def _rfftn(a, axes=None):
+    """N-dimensional FFT of a real array, using the selected backend.
+
+    Single precision is kept for float32 input, and other real input is
+    transformed in double precision. By default, all axes are transformed.
+    """
+    if a.dtype != np.float32:
+        a = np.asarray(a, dtype=np.float64)
+    if FFT_BACKEND == 'pyfftw':
         global planned
         if not planned:
             print_update("Note: FFTW is configuring itself. This will take " +
                          "several seconds, but subsequent calls will run " +
                          "*much* faster.")
             planned = True
-        a = pyfftw.n_byte_align(a, a.dtype.alignment)
-        return pyfftw.interfaces.numpy_fft.fftn(a).astype(np.complex128)
+        return pyfftw.interfaces.numpy_fft.rfftn(a, axes=axes,
+                                                 threads=FFT_WORKERS)
+    elif FFT_BACKEND == 'scipy':
+        return scipy_fft.rfftn(a, axes=axes, workers=FFT_WORKERS)
+    else:
+        result = np.fft.rfftn(a, axes=axes)
+        if a.dtype == np.float32:
+            result = result.astype(np.complex64)
+        return result
+
 
-    def ifftn(a):
-        a = pyfftw.n_byte_align(a, a.dtype.alignment)
-        return pyfftw.interfaces.numpy_fft.ifftn(a)
+def _irfftn(a, shape, axes=None):
+    """Inverse of _rfftn, given the shape of the original array along the
+    transformed axes."""
+    if FFT_BACKEND == 'pyfftw':
+        return pyfftw.interfaces.numpy_fft.irfftn(a, shape, axes,
+                                                  threads=FFT_WORKERS)
+    elif FFT_BACKEND == 'scipy':
+        return scipy_fft.irfftn(a, shape, axes, workers=FFT_WORKERS)
+    else:
+        result = np.fft.irfftn(a, shape, axes)
+        if a.dtype == np.complex64:
+            result = result.astype(np.float32)
+        return result
 
 
-def bandpass(image, lshort, llong, threshold=None):
+def bandpass(image, lshort, llong, threshold=None, method='auto',
+             stack=False, dtype=None):
     """Convolve with a Gaussian to remove short-wavelength noise,
     and subtract out long-wavelength variations,
     retaining features of intermediate scale.
@@ -54,33 +132,204 @@ def bandpass(image, lshort, llong, threshold=None):
 
     threshold : float or integer
         By default, 1 for integer images and 1/256. for float images.
+    method : {'auto', 'fourier', 'real'}
+        Apply the Gaussian by multiplication in Fourier space, or by
+        convolution with a (truncated) Gaussian in real space. By default,
+        the cheaper one is chosen, based on the sizes of the image and of
+        the Gaussian. Real space is faster for small lshort.
+    stack : boolean
+        If True, image is a stack of images along its first axis, such as a
+        (T, Y, X) movie, and each image is bandpassed separately: lshort and
+        llong apply to the remaining axes only. The stack is processed in
+        chunks, to bound the memory used for intermediate arrays. False by
+        default.
+    dtype : {None, numpy.float32, numpy.float64}
+        Floating point type of the computation and of the result. Single
+        precision halves the memory traffic, which limits the speed for
+        large images. By default, float32 images are processed in single
+        precision, and all others in double precision.
 
     Returns
     -------
     ndarray, the bandpassed image
     """
-    lshort = validate_tuple(lshort, image.ndim)      
-    llong = validate_tuple(llong, image.ndim)
+    ndim = image.ndim - 1 if stack else image.ndim
+    lshort = validate_tuple(lshort, ndim)
+    llong = validate_tuple(llong, ndim)
     if np.any([x*2 >= y for (x, y) in zip(lshort, llong)]):
         raise ValueError("The smoothing length scale must be more" +
                          "than twice the noise length scale.")
+    if method not in ('auto', 'fourier', 'real'):
+        raise ValueError("Available methods are 'auto', 'fourier' and "
+                         "'real'")
+    dtype = _float_dtype(image.dtype, dtype)
+    return _bandpass(image, lshort, llong, threshold, method=method,
+                     stack=stack, dtype=dtype)
+
+
+def _bandpass(image, lshort, llong, threshold=None, kernel=None,
+              buffers=None, method='auto', stack=False, dtype=None):
+    """Bandpass without validating the length scales.
+
+    Parameters
+    ----------
+    image, lshort, llong, threshold : see bandpass
+    kernel : ndarray, optional
+        The Gaussian kernel in Fourier space, as made by
+        _fourier_gaussian_kernel(shape, lshort), where shape is the shape of
+        one image. Computed if None.
+    buffers : pair of ndarrays, optional
+        Work buffers for the boxcar, with the shape and dtype of image.
+    method : {'auto', 'fourier', 'real'}
+        See bandpass. If 'auto', the method is chosen by gaussian_method.
+    stack : boolean
+        See bandpass.
+    dtype : numpy.float32 or numpy.float64, optional
+        See bandpass. The kernel should have this dtype too.
+    """
+    dtype = _float_dtype(image.dtype, dtype)
+    if stack:
+        # Process the stack in chunks, if it is large.
+        chunksize = max(1, STACK_CHUNK_SIZE // int(np.prod(image.shape[1:])))
+        if len(image) > chunksize:
+            result = None
+            for start in range(0, len(image), chunksize):
+                chunk = _bandpass(image[start:start + chunksize], lshort,
+                                  llong, threshold, kernel, None, method,
+                                  stack, dtype)
+                if result is None:
+                    result = np.empty(image.shape, dtype=chunk.dtype)
+                result[start:start + chunksize] = chunk
+            return result
+        first_axis = 1
+    else:
+        first_axis = 0
+    # Filter along these axes only.
+    axes = range(first_axis, image.ndim)
+    shape = image.shape[first_axis:]
+
     if threshold is None:
         if np.issubdtype(image.dtype, np.integer):
             threshold = 1
         else:
             threshold = 1/256.
     settings = dict(mode='nearest', cval=0)
-    axes = range(image.ndim)
     sizes = [x*2+1 for x in llong]
     boxcar = np.asarray(image)
-    for (axis, size) in zip(axes, sizes):
-        boxcar = uniform_filter1d(boxcar, size, axis, **settings)
-    gaussian = ifftn(fourier_gaussian(fftn(image), lshort)).real
-    result = gaussian - boxcar
-    return np.where(result > threshold, result, 0)
+    for i, (axis, size) in enumerate(zip(axes, sizes)):
+        output = None if buffers is None else buffers[i % 2]
+        boxcar = uniform_filter1d(boxcar, size, axis, output, **settings)
+    if method == 'auto':
+        method = gaussian_method(shape, lshort)
+    if method == 'real':
+        # Compute in floating point from the first pass on, and then in
+        # place.
+        output = dtype
+        gaussian = np.asarray(image)
+        for (axis, sigma) in zip(axes, lshort):
+            gaussian = gaussian_filter1d(gaussian, sigma, axis,
+                                         output=output,
+                                         truncate=GAUSSIAN_TRUNCATE,
+                                         **settings)
+            output = gaussian
+    else:
+        transformed = _rfftn(np.asarray(image, dtype=dtype), axes)
+        if kernel is None:
+            # A width of 0 leaves the stack axis alone.
+            sigma = (0,)*first_axis + tuple(lshort)
+            fourier_gaussian(transformed, sigma, shape[-1],
+                             output=transformed)
+        else:
+            transformed *= kernel
+        gaussian = _irfftn(transformed, shape, axes)
+    # gaussian is a new array, so finish in place.
+    result = np.subtract(gaussian, boxcar, out=gaussian)
+    result[~(result > threshold)] = 0
+    return result
+
+
+def _float_dtype(image_dtype, dtype=None):
+    """Return the floating point dtype for preprocessing an image."""
+    if dtype is None:
+        if image_dtype == np.float32:
+            return np.dtype(np.float32)
+        return np.dtype(np.float64)
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError("The dtype must be float32 or float64.")
+    return dtype
+
 
+def gaussian_method(shape, sigma):
+    """Choose whether a Gaussian filter is cheaper in real space or in
+    Fourier space, for an image of this shape.
+
+    Parameters
+    ----------
+    shape : tuple
+    sigma : tuple, the width of the Gaussian along each axis
+
+    Returns
+    -------
+    'real' or 'fourier'
+    """
+    # Estimate costs in units of one multiply-add per pixel.
+    size = np.prod(shape)
+    real_cost = sum([GAUSSIAN_PASS_COST + 2*int(GAUSSIAN_TRUNCATE*s + 0.5) + 1
+                     for s in sigma])
+    fourier_cost = FFT_COST*np.log2(max(size, 2))
+    if real_cost <= fourier_cost:
+        return 'real'
+    else:
+        return 'fourier'
 
-def scale_to_gamut(image, original_dtype):
+
+def _fourier_gaussian_kernel(shape, sigma):
+    """The multiplier that fourier_gaussian applies to the real FFT of an
+    array of this shape (see _rfftn). It can be reused between images."""
+    rshape = tuple(shape[:-1]) + (shape[-1]//2 + 1,)
+    return fourier_gaussian(np.ones(rshape), sigma, shape[-1])
+
+
+def scale_to_gamut(image, original_dtype, image_max=None, out=None,
+                   dtype=None, overwrite_input=False):
+    """Rescale a (bandpassed) image to fill the range of an integer dtype.
+
+    Parameters
+    ----------
+    image : ndarray
+    original_dtype : integer dtype of the result
+    image_max : number, optional
+        The value that is mapped onto the maximum of the dtype. By default,
+        this is the maximum of image. Pass the maximum of a larger image to
+        scale a part of it consistently with the rest. Larger values are
+        clipped.
+    out : ndarray of original_dtype, optional
+        Array in which to place the result.
+    dtype : {None, numpy.float32, numpy.float64}
+        Floating point type used for the scaling. By default, float32 images
+        are scaled in single precision, and all others in double precision.
+    overwrite_input : boolean
+        If True, and image already has the floating point type, scale it in
+        place rather than in a temporary array. False by default.
+
+    Returns
+    -------
+    ndarray of original_dtype
+    """
+    if image_max is None:
+        image_max = image.max()
     max_value = np.iinfo(original_dtype).max
-    scaled = (max_value/image.max()*image.clip(min=0.))
-    return scaled.astype(original_dtype)
+    dtype = _float_dtype(image.dtype, dtype)
+    if image.dtype != dtype:
+        scaled = image.astype(dtype)
+        scaled.clip(0., image_max, out=scaled)
+    elif overwrite_input:
+        scaled = image.clip(0., image_max, out=image)
+    else:
+        scaled = image.clip(0., image_max)
+    scaled *= max_value/image_max
+    if out is None:
+        return scaled.astype(original_dtype)
+    np.copyto(out, scaled, casting='unsafe')
+    return out
@@ -3,6 +3,8 @@ from __future__ import (absolute_import, division, print_function,
 import six
 from six.moves import range
 import os
+import pickle
+import tempfile
 import unittest
 import warnings
 
@@ -10,13 +12,16 @@ import nose
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, Series
-from numpy.testing import assert_almost_equal, assert_allclose
+from scipy import ndimage
+from numpy.testing import (assert_almost_equal, assert_allclose,
+                           assert_array_equal)
 from numpy.testing.decorators import slow
 from pandas.util.testing import (assert_series_equal, assert_frame_equal,
                                  assert_produces_warning)
 
 import trackpy as tp
 from trackpy.try_numba import NUMBA_AVAILABLE
+from trackpy.feature import _shift_neighborhoods
 from trackpy.artificial import (draw_feature, draw_spots, draw_point,
                                 gen_nonoverlapping_locations)
 
@@ -44,9 +49,6 @@ class CommonFeatureIdentificationTests(object):
     def check_skip(self):
         pass
 
-    def skip_numba(self):
-        pass
-
     def test_smoke_datatypes(self):
         self.check_skip()
         SHAPE = (300, 300)
@@ -75,7 +77,7 @@ class CommonFeatureIdentificationTests(object):
             f = tp.locate(black_image, 5, engine=self.engine)
 
     def test_maxima_in_margin_3D(self):
-        self.skip_numba()
+        self.check_skip()
         black_image = np.ones((21, 23, 25)).astype(np.uint8)
         draw_point(black_image, [1, 1, 1], 100)
         with assert_produces_warning(UserWarning):
@@ -164,6 +166,20 @@ class CommonFeatureIdentificationTests(object):
         expected = DataFrame(np.asarray(pos).reshape(1, -1), columns=cols)
         assert_allclose(actual, expected, atol=0.1)
 
+    def test_flat_peak_chain(self):
+        # A is close to B and B is close to C, but A is far from C. B and C
+        # are both dropped, because each has a brighter neighbor.
+        self.check_skip()
+        image = np.ones((21, 25)).astype(np.uint8)
+        draw_point(image, [10, 7], 100)
+        draw_point(image, [10, 12], 90)
+        draw_point(image, [10, 17], 80)
+        cols = ['y', 'x']
+        actual = tp.locate(image, 5, preprocess=False,
+                           engine=self.engine)[cols]
+        expected = DataFrame([[10, 7]], columns=cols)
+        assert_allclose(actual, expected, atol=0.1)
+
     def test_one_centered_gaussian(self):
         self.check_skip()
         L = 21
@@ -179,7 +195,7 @@ class CommonFeatureIdentificationTests(object):
         assert_allclose(actual, expected, atol=0.1)
 
     def test_one_centered_gaussian_3D(self):
-        self.skip_numba()
+        self.check_skip()
         L = 21
         dims = (L, L + 2, L + 4)  # avoid square images in tests
         pos = [7, 13, 9]
@@ -193,7 +209,7 @@ class CommonFeatureIdentificationTests(object):
         assert_allclose(actual, expected, atol=0.1)
 
     def test_one_centered_gaussian_3D_anisotropic(self):
-        self.skip_numba()
+        self.check_skip()
         L = 21
         dims = (L, L + 2, L + 4)  # avoid square images in tests
         pos = [7, 13, 9]
@@ -371,7 +387,7 @@ class CommonFeatureIdentificationTests(object):
         assert_allclose(actual, expected, atol=0.5)
 
     def test_multiple_anisotropic_3D_simple(self):
-        self.skip_numba()
+        self.check_skip()
         actual, expected = compare((100, 120, 10), 4, (4, 4, 2), noise_level=0,
                                    engine=self.engine)
         assert_allclose(actual, expected, atol=0.5)
@@ -499,6 +515,46 @@ class TestFeatureIdentificationWithVanillaNumpy(
         self.engine = 'python'
 
 
+class TestFeatureIdentificationWithVectorized(
+    CommonFeatureIdentificationTests, unittest.TestCase):
+
+    def setUp(self):
+        self.engine = 'vectorized'
+
+    def test_same_as_python(self):
+        np.random.seed(0)
+        shape = (200, 300)
+        pos = gen_nonoverlapping_locations(shape, 20, 15, 10)
+        image = draw_spots(shape, pos, 9, noise_level=10)
+        coords = tp.local_maxima(image, 4, margin=5)
+        expected = tp.refine(image, image, 4, coords, engine='python')
+        actual = tp.refine(image, image, 4, coords, engine=self.engine)
+        assert_allclose(actual, expected)
+
+    def test_shift_neighborhoods(self):
+        np.random.seed(0)
+        for shape, dtype in [((30, 9, 9), np.uint8), ((30, 9, 9), np.float64),
+                             ((10, 7, 5, 9), np.int16)]:
+            neighborhoods = (np.random.rand(*shape)*200).astype(dtype)
+            offsets = np.random.rand(shape[0], len(shape) - 1)*2 - 1
+            expected = [ndimage.shift(n, -o, order=2, mode='constant', cval=0)
+                        for (n, o) in zip(neighborhoods, offsets)]
+            actual = _shift_neighborhoods(neighborhoods, offsets)
+            self.assertEqual(actual.dtype, dtype)
+            assert_allclose(actual, expected, atol=1e-10)
+
+    def test_iteration_stats(self):
+        np.random.seed(0)
+        pos = gen_nonoverlapping_locations((200, 300), 20, 15, 10)
+        image = draw_spots((200, 300), pos, 9, noise_level=10)
+        coords = tp.local_maxima(image, 4, margin=5)
+        stats = dict()
+        tp.refine(image, image, 4, coords, max_iterations=10,
+                  engine=self.engine, stats=stats)
+        self.assertEqual(len(stats['iterations']), len(coords))
+        self.assertTrue(np.all(stats['iterations'] <= 10))
+
+
 class TestFeatureIdentificationWithNumba(
     CommonFeatureIdentificationTests, unittest.TestCase):
 
@@ -509,10 +565,373 @@ class TestFeatureIdentificationWithNumba(
         if not NUMBA_AVAILABLE:
             raise nose.SkipTest("Numba not installed. Skipping.")
 
-    def skip_numba(self):
-        raise nose.SkipTest("This feature is not "
-                            "supported by the numba variant. Skipping.")
 
+class TestPrefilter(unittest.TestCase):
+
+    def test_estimates_match(self):
+        np.random.seed(0)
+        for shape, radius in [((200, 300), (4, 4)), ((40, 50, 60), (2, 3, 3))]:
+            pos = gen_nonoverlapping_locations(shape, 10, 10, 10)
+            image = draw_spots(shape, pos, 9, noise_level=10)
+            coords = tp.local_maxima(image, radius)
+            mass, size = tp.feature._estimate_mass_and_size(image, radius,
+                                                            coords)
+            expected_mass = [tp.estimate_mass(image, radius, c)
+                             for c in coords]
+            expected_size = [tp.estimate_size(image, radius, c, m)
+                             for c, m in zip(coords, expected_mass)]
+            assert_allclose(mass, expected_mass)
+            assert_allclose(size, expected_size)
+
+
+class TestLocalMaxima(unittest.TestCase):
+
+    def test_separable_dilation(self):
+        np.random.seed(0)
+        for shape, radius in [((200, 300), 6), ((200, 300), (3, 8)),
+                              ((30, 40, 50), (2, 4, 4))]:
+            pos = gen_nonoverlapping_locations(shape, 20, 10, 5)
+            image = draw_spots(shape, pos, 9, noise_level=20)
+            for margin in [0, radius]:
+                expected = tp.local_maxima(image, radius, 30, margin,
+                                           dilation='ndimage')
+                actual = tp.local_maxima(image, radius, 30, margin,
+                                         dilation='separable')
+                assert_allclose(actual, expected)
+
+
+class TestPercentileThreshold(unittest.TestCase):
+
+    def test_integer_images(self):
+        np.random.seed(0)
+        for dtype in [np.uint8, np.uint16, np.int16, np.int32]:
+            info = np.iinfo(dtype)
+            image = np.random.randint(max(info.min, -1000),
+                                      min(info.max, 5000),
+                                      (64, 65)).astype(dtype)
+            image[:10] = 0
+            not_black = image[np.nonzero(image)]
+            for percentile in [0, 10, 50, 64, 99.9, 100]:
+                actual = tp.percentile_threshold(image, percentile)
+                expected = np.percentile(not_black, percentile)
+                assert_allclose(actual, expected)
+
+    def test_black_image(self):
+        image = np.zeros((10, 11), dtype=np.uint16)
+        assert np.isnan(tp.percentile_threshold(image, 64))
+
+
+class MemoryStore(tp.FramewiseData):
+    """Keep each frame's features in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def put(self, df):
+        self.data[df['frame'].iloc[0]] = df
+
+    def get(self, frame_no):
+        return self.data[frame_no]
+
+    @property
+    def frames(self):
+        return sorted(self.data)
+
+    @property
+    def t_column(self):
+        return 'frame'
+
+    def close(self):
+        pass
+
+
+class RecordingSequence(object):
+    """A sequence of images that records which ones were read."""
+
+    def __init__(self, images):
+        self.images = images
+        self.read = []
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, i):
+        self.read.append(i)
+        return self.images[i]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        shape = (128, 128)
+        self.frames = []
+        for i in range(4):
+            pos = gen_nonoverlapping_locations(shape, 10, 15, 10)
+            self.frames.append(draw_spots(shape, pos, 9, noise_level=1))
+        self.expected = tp.batch(self.frames, 9, engine='python', meta=False)
+
+    def test_processes(self):
+        actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                          processes=2)
+        assert_frame_equal(actual, self.expected)
+
+    def test_executor(self):
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            raise nose.SkipTest("concurrent.futures not available. Skipping.")
+        with ThreadPoolExecutor(2) as executor:
+            actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                              executor=executor)
+        assert_frame_equal(actual, self.expected)
+        with ThreadPoolExecutor(2) as executor:
+            actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                              executor=executor, max_pending=1)
+        assert_frame_equal(actual, self.expected)
+
+    def test_meta(self):
+        import yaml
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            tp.batch(self.frames, 9, engine='python', meta=filename,
+                     noise_interval=2, dtype=np.float32)
+            with open(filename) as f:
+                meta = yaml.safe_load(f)
+        finally:
+            os.remove(filename)
+        self.assertEqual(meta['engine'], 'python')
+        self.assertEqual(meta['noise_interval'], 2)
+        self.assertEqual(meta['dtype'], 'float32')
+        self.assertIsNone(meta['guide_range'])
+
+    def test_noise_interval(self):
+        actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                          noise_interval=2)
+        measured = actual['frame'] % 2 == 0
+        assert_frame_equal(actual[measured],
+                           self.expected[self.expected['frame'] % 2 == 0])
+        # Noise only affects signal and ep.
+        columns = ['x', 'y', 'mass', 'size', 'ecc', 'frame']
+        assert_frame_equal(actual[columns], self.expected[columns])
+        for noise_interval in [0, -1, 1.5]:
+            self.assertRaises(ValueError, tp.batch, self.frames, 9,
+                              meta=False, noise_interval=noise_interval)
+        self.assertRaises(ValueError, tp.batch, self.frames, 9, meta=False,
+                          noise_interval=2, executor=object())
+
+    def test_stack(self):
+        actual = tp.locate(np.array(self.frames), 9, engine='python',
+                           stack=True)
+        assert_frame_equal(actual, self.expected)
+        empty = tp.locate(np.array(self.frames)[:0], 9, engine='python',
+                          stack=True)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(list(empty.columns), list(self.expected.columns))
+
+    def test_as_array(self):
+        actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                          as_array=True)
+        self.assertEqual(actual.dtype.names, tuple(self.expected.columns))
+        assert_frame_equal(DataFrame(actual), self.expected)
+        self.assertRaises(ValueError, tp.batch, self.frames, 9, meta=False,
+                          output=MemoryStore(), as_array=True)
+
+    def test_prefetch(self):
+        for prefetch in [1, 3, 10]:
+            actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                              prefetch=prefetch)
+            assert_frame_equal(actual, self.expected)
+        actual = tp.batch(self.frames, 9, engine='python', meta=False,
+                          processes=2, prefetch=2)
+        assert_frame_equal(actual, self.expected)
+
+    def test_prefetch_error(self):
+        def broken_reader():
+            yield self.frames[0]
+            raise IOError("Cannot read frame 1.")
+        self.assertRaises(IOError, tp.batch, broken_reader(), 9,
+                          engine='python', meta=False, prefetch=2)
+
+    def test_resume(self):
+        store = MemoryStore()
+        for frame_no in [0, 2]:
+            store.put(self.expected[self.expected['frame'] == frame_no])
+        frames = RecordingSequence(self.frames)
+        tp.batch(frames, 9, engine='python', meta=False, output=store,
+                 resume=True)
+        self.assertEqual(frames.read, [1, 3])
+        assert_frame_equal(store.dump().reset_index(drop=True),
+                           self.expected)
+        # Frames that cannot be indexed are read, but not located.
+        del store.data[3]
+        tp.batch(iter(self.frames), 9, engine='python', meta=False,
+                 output=store, resume=True, prefetch=2)
+        assert_frame_equal(store.dump().reset_index(drop=True),
+                           self.expected)
+        self.assertRaises(ValueError, tp.batch, self.frames, 9, meta=False,
+                          resume=True)
+
+    def test_guided(self):
+        np.random.seed(0)
+        shape = (256, 256)
+        pos = gen_nonoverlapping_locations(shape, 10, 40, 20)
+        frames = []
+        for i in range(6):
+            pos = pos + np.random.randn(*pos.shape)
+            frames.append(draw_spots(shape, pos, 9, noise_level=10))
+        # Guided frames take the threshold of the latest full scan, so
+        # they find the same features, with the same mass, at the default
+        # minmass.
+        params = dict(diameter=9, engine='python', meta=False)
+        expected = tp.batch(frames, **params)
+        actual = tp.batch(frames, guide_range=10, full_scan_interval=4,
+                          **params)
+        sort = lambda f: f.sort(['frame', 'x']).reset_index(drop=True)
+        self.assertEqual(len(actual), len(expected))
+        assert_allclose(sort(actual)[['x', 'y', 'frame']],
+                        sort(expected)[['x', 'y', 'frame']], atol=0.01)
+        assert_allclose(sort(actual)['mass'], sort(expected)['mass'],
+                        rtol=0.01)
+        self.assertRaises(ValueError, tp.batch, frames, guide_range=10,
+                          processes=2, **params)
+        self.assertRaises(ValueError, tp.batch, frames, guide_range=10,
+                          full_scan_interval=0, **params)
+
+    def test_profile(self):
+        actual, profile = tp.batch(self.frames, 9, engine='python',
+                                   meta=False, profile=True)
+        assert_frame_equal(actual, self.expected)
+        self.assertEqual(list(profile['frame']), list(range(4)))
+        assert_array_equal(profile['features'],
+                           self.expected.groupby('frame').size().values)
+        self.assertTrue(np.all(profile['maxima'] >= profile['prefiltered']))
+        self.assertTrue(np.all(profile['total_time'] > 0))
+        self.assertTrue(np.all(profile['dedup_time'] >= 0))
+        _, parallel_profile = tp.batch(self.frames, 9, engine='python',
+                                       meta=False, processes=2, profile=True)
+        assert_frame_equal(parallel_profile[['frame', 'features']],
+                           profile[['frame', 'features']])
+
+
+class TestLocator(unittest.TestCase):
+
+    def test_same_as_locate(self):
+        np.random.seed(0)
+        locator = tp.Locator(9, minmass=200, engine='python')
+        # Alternate shapes and dtypes, to exercise the kept work buffers.
+        for shape in [(128, 128), (100, 120), (128, 128), (40, 50, 60)]:
+            pos = gen_nonoverlapping_locations(shape, 10, 15, 10)
+            image = draw_spots(shape, pos, 9, noise_level=10)
+            for frame in [image, image.astype(np.float64)/255]:
+                expected = tp.locate(frame, 9, minmass=200, engine='python')
+                assert_frame_equal(locator(frame), expected)
+
+    def test_as_array(self):
+        np.random.seed(0)
+        pos = gen_nonoverlapping_locations((128, 128), 10, 15, 10)
+        image = draw_spots((128, 128), pos, 9, noise_level=10)
+        for params in [dict(), dict(characterize=False), dict(minmass=1e9),
+                       dict(tile_size=64)]:
+            expected = tp.locate(image, 9, engine='python', **params)
+            actual = tp.locate(image, 9, engine='python', as_array=True,
+                               **params)
+            self.assertEqual(actual.dtype.names, tuple(expected.columns))
+            columns = [actual[name] for name in actual.dtype.names]
+            assert_allclose(np.column_stack(columns).reshape(expected.shape),
+                            expected.values.astype(np.float64))
+
+    def test_single_precision(self):
+        np.random.seed(0)
+        pos = gen_nonoverlapping_locations((128, 128), 10, 15, 10)
+        image = draw_spots((128, 128), pos, 9, noise_level=10)
+        expected = tp.locate(image, 9, engine='python')
+        actual = tp.locate(image, 9, engine='python', dtype=np.float32)
+        assert_allclose(actual[['x', 'y']], expected[['x', 'y']], atol=0.01)
+
+    def test_profile(self):
+        np.random.seed(0)
+        pos = gen_nonoverlapping_locations((128, 128), 10, 15, 10)
+        image = draw_spots((128, 128), pos, 9, noise_level=10)
+        locator = tp.Locator(9, engine='python')
+        locator(image)
+        self.assertIsNone(locator.last_profile)
+        locator = tp.Locator(9, engine='python', profile=True)
+        f = locator(image)
+        profile = locator.last_profile
+        self.assertEqual(profile['features'], len(f))
+        stage_time = sum(v for k, v in profile.items()
+                         if k.endswith('_time') and k != 'total_time')
+        self.assertLessEqual(stage_time, profile['total_time'])
+
+    def test_pickle(self):
+        locator = tp.Locator(9, engine='python')
+        locator(np.zeros((64, 64), dtype=np.uint8))
+        copy = pickle.loads(pickle.dumps(locator))
+        self.assertEqual(copy.diameter, 9)
+
+
+class TestLocateTiled(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.shape = (300, 400)
+        pos = gen_nonoverlapping_locations(self.shape, 150, 20, 8)
+        self.image = draw_spots(self.shape, pos, 15, noise_level=10)
+        # Spurious features near minmass depend on the percentile threshold,
+        # which is determined per tile. Leave them out.
+        self.params = dict(diameter=9, minmass=1000, engine='python')
+        self.expected = self.sort(tp.locate(self.image, **self.params))
+
+    def sort(self, f):
+        return f.sort(['x', 'y']).reset_index(drop=True)
+
+    def test_same_as_untiled(self):
+        for tile_size in [64, (100, 150)]:
+            actual = self.sort(tp.locate(self.image, tile_size=tile_size,
+                                         **self.params))
+            self.assertEqual(len(actual), len(self.expected))
+            assert_allclose(actual[['x', 'y']], self.expected[['x', 'y']],
+                            atol=0.01)
+            assert_allclose(actual['mass'], self.expected['mass'], rtol=0.01)
+
+    def test_topn(self):
+        expected = tp.locate(self.image, topn=10, **self.params)
+        actual = tp.locate(self.image, topn=10, tile_size=64, **self.params)
+        self.assertEqual(len(actual), 10)
+        assert_allclose(self.sort(actual)['mass'],
+                        self.sort(expected)['mass'], rtol=0.01)
+
+    def test_blank_tiles(self):
+        # Blank tiles do not warn about missing maxima.
+        image = self.image.copy()
+        image[:, 200:] = 0
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            tp.locate(image, tile_size=64, **self.params)
+        messages = [str(warning.message) for warning in w]
+        self.assertFalse([m for m in messages if 'maxima' in m])
+
+    def test_memmap(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            image = np.memmap(filename, dtype=self.image.dtype, mode='w+',
+                              shape=self.shape)
+            image[:] = self.image
+            image.flush()
+            image = np.memmap(filename, dtype=self.image.dtype, mode='r',
+                              shape=self.shape)
+            actual = self.sort(tp.locate(image, tile_size=100, **self.params))
+            del image
+        finally:
+            os.remove(filename)
+        assert_allclose(actual[['x', 'y']], self.expected[['x', 'y']],
+                        atol=0.01)
 
 if __name__ == '__main__':
     import nose
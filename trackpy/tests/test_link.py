@@ -16,7 +16,8 @@ from pandas.util.testing import (assert_series_equal, assert_frame_equal,
 
 import trackpy as tp
 from trackpy.try_numba import NUMBA_AVAILABLE
-from trackpy.linking import PointND, link, Hash_table
+from trackpy.linking import (PointND, TreeFinder, link, Hash_table,
+                             assign_candidates, hungarian_link, numba_link)
 
 
 path, _ = os.path.split(os.path.abspath(__file__))
@@ -43,6 +44,18 @@ def _skip_if_no_numba():
         raise nose.SkipTest('numba not installed. Skipping.')
 
 
+def _skip_if_no_linear_sum_assignment():
+    if tp.linking.linear_sum_assignment is None:
+        raise nose.SkipTest('scipy >= 0.17 not installed. Skipping.')
+
+
+def _skip_if_no_concurrent_futures():
+    try:
+        import concurrent.futures
+    except ImportError:
+        raise nose.SkipTest('concurrent.futures not available. Skipping.')
+
+
 def random_walk(N):
     return np.cumsum(np.random.randn(N))
 
@@ -350,6 +363,155 @@ class TestOnce(unittest.TestCase):
         tp.link_df(f, 5, t_column=name, verify_integrity=True)
         tp.link_df_iter(f, 5, t_column=name, verify_integrity=True)
 
+    def test_simple_links(self):
+        # a and b are each other's only candidate; c and d compete for e.
+        a, c, d = PointND(0, (0, 0)), PointND(0, (10, 0)), PointND(0, (12, 0))
+        b, e = PointND(1, (1, 0)), PointND(1, (10.5, 0))
+        prev_hash = TreeFinder([a, c, d])
+        for p in [a, b, c, d, e]:
+            p.back_cands, p.forward_cands = [], []
+        spl, dpl = assign_candidates([b, e], prev_hash, 5, 'KDTree',
+                                     simple_links=True)
+        self.assertEqual((spl, dpl), ([a], [b]))
+        self.assertEqual(a.forward_cands, [])
+        self.assertEqual([cand for cand, dist in e.back_cands], [c, d])
+
+    def test_all_candidates(self):
+        # More candidates than the KDTree is first asked for
+        np.random.seed(0)
+        angles = np.random.rand(15) * 2 * np.pi
+        radii = np.random.rand(15) + 0.5
+        prev = [PointND(0, (50 + r*np.cos(a), 50 + r*np.sin(a)))
+                for r, a in zip(radii, angles)]
+        prev.append(PointND(0, (0, 0)))
+        cur = [PointND(1, (50, 50)), PointND(1, (50.5, 50)),
+               PointND(1, (0, 1))]
+        for p in prev + cur:
+            p.back_cands, p.forward_cands = [], []
+        assign_candidates(cur, TreeFinder(prev), 2, 'KDTree')
+        for p in cur:
+            expected = sorted(p.distance(wp) for wp in prev
+                              if p.distance(wp) < 2)
+            assert_allclose([dist for cand, dist in p.back_cands], expected)
+        for wp in prev:
+            expected = sorted(wp.distance(p) for p in cur
+                              if wp.distance(p) < 2)
+            assert_allclose([dist for cand, dist in wp.forward_cands],
+                            expected)
+
+    def test_hungarian_same_cost_as_numba(self):
+        _skip_if_no_linear_sum_assignment()
+        def cost(spl, dpl, search_range):
+            return sum(search_range**2 if dp is None else sp.distance(dp)**2
+                       for sp, dp in zip(spl, dpl))
+        np.random.seed(0)
+        for trial in range(20):
+            sources = [PointND(0, pos) for pos in np.random.rand(6, 2) * 3]
+            dests = [PointND(1, pos) for pos in np.random.rand(7, 2) * 3]
+            for sp in sources:
+                sp.forward_cands = sorted(
+                    [(dp, sp.distance(dp)) for dp in dests
+                     if sp.distance(dp) < 2], key=lambda x: x[1])
+                sp.forward_cands.append((None, 2))
+            expected = cost(*(numba_link(sources, len(dests), 2) + (2,)))
+            actual = cost(*(hungarian_link(sources, len(dests), 2) + (2,)))
+            assert_allclose(actual, expected)
+
+    def test_fallback_strategy(self):
+        _skip_if_no_linear_sum_assignment()
+        groups = lambda tr: sorted(tuple(sorted(ind)) for ind
+                                   in tr.groupby('particle').groups.values())
+        for engine in ['python', 'numpy']:
+            expected = tp.link_df(contracting_grid(), 1, engine=engine,
+                                  link_strategy='hungarian',
+                                  retain_index=True)
+            actual = tp.link_df(contracting_grid(), 1, engine=engine,
+                                link_strategy='recursive',
+                                fallback_strategy='hungarian',
+                                retain_index=True)
+            self.assertEqual(groups(actual), groups(expected))
+
+    def test_numpy_engine_same_as_python(self):
+        np.random.seed(0)
+        N, T = 100, 20
+        pos = np.random.rand(N, 2) * 100
+        frames = []
+        for t in range(T):
+            pos = pos + np.random.randn(N, 2)
+            # Some features go missing, and come back.
+            present = np.random.rand(N) > 0.1
+            frames.append(DataFrame({'x': pos[present, 0],
+                                     'y': pos[present, 1], 'frame': t}))
+        f = pd.concat(frames, ignore_index=True)
+        for memory in [0, 2]:
+            expected = tp.link_df(f.copy(), 3, memory=memory,
+                                  link_strategy='recursive',
+                                  retain_index=True)
+            actual = tp.link_df(f.copy(), 3, memory=memory,
+                                link_strategy='recursive',
+                                retain_index=True, engine='numpy')
+            # Tracks that begin in the same frame may be numbered in a
+            # different order. Compare the grouping of features into tracks.
+            groups = lambda tr: sorted(tuple(sorted(ind)) for ind
+                                       in tr.groupby('particle').groups.values())
+            self.assertEqual(groups(actual), groups(expected))
+
+    def test_numpy_engine_new_tracks_in_row_order(self):
+        f = DataFrame({'x': [0, 0, 10, 20, 30], 'y': [0, 0, 0, 0, 0],
+                       'frame': [0, 1, 1, 1, 1]})
+        actual = tp.link_df(f, 1, retain_index=True, engine='numpy')
+        assert_allclose(actual['particle'].values, [0, 0, 1, 2, 3])
+
+    def test_numpy_engine_unsupported(self):
+        f = self.features
+        self.assertRaises(ValueError, tp.link_df, f, 5, engine='fortran')
+        self.assertRaises(ValueError, tp.link_df, f, 5, engine='numpy',
+                          neighbor_strategy='BTree', hash_size=(10, 10))
+        self.assertRaises(NotImplementedError, tp.link_df, f, 5,
+                          engine='numpy', diagnostics=True)
+
+    def test_numpy_engine_executor(self):
+        _skip_if_no_concurrent_futures()
+        from concurrent.futures import ThreadPoolExecutor
+
+        class CountingExecutor(ThreadPoolExecutor):
+            submitted = 0
+
+            def submit(self, *args, **kwargs):
+                self.submitted += 1
+                return super(CountingExecutor, self).submit(*args, **kwargs)
+
+        # Dense features, to make many subnets in each frame.
+        np.random.seed(0)
+        N, T = 300, 5
+        pos = np.random.rand(N, 2) * 100
+        frames = []
+        for t in range(T):
+            pos = pos + np.random.randn(N, 2)
+            frames.append(DataFrame({'x': pos[:, 0], 'y': pos[:, 1],
+                                     'frame': t}))
+        f = pd.concat(frames, ignore_index=True)
+        chunk_size = tp.linking.ArrayLinker.PARALLEL_CHUNK_SIZE
+        tp.linking.ArrayLinker.PARALLEL_CHUNK_SIZE = 10
+        try:
+            for kwargs in [dict(link_strategy='recursive'),
+                           dict(link_strategy='nonrecursive',
+                                adaptive_stop=1)]:
+                expected = tp.link_df(f.copy(), 4, engine='numpy', **kwargs)
+                executor = CountingExecutor(4)
+                actual = tp.link_df(f.copy(), 4, engine='numpy',
+                                    executor=executor, **kwargs)
+                executor.shutdown()
+                self.assertTrue(executor.submitted > T)
+                # Track labels are the same as without the executor.
+                assert_allclose(actual['particle'].values,
+                                expected['particle'].values)
+        finally:
+            tp.linking.ArrayLinker.PARALLEL_CHUNK_SIZE = chunk_size
+        with ThreadPoolExecutor(1) as executor:
+            self.assertRaises(ValueError, tp.link_df, f, 4,
+                              executor=executor)
+
 class SubnetNeededTests(CommonTrackingTests):
     """Tests that assume a best-effort subnet linker (i.e. not "drop")."""
     def test_two_nearby_steppers(self):
@@ -622,6 +784,20 @@ class DiagnosticsTests(CommonTrackingTests):
         return df.reindex(columns=['frame', 'x', 'y', 'particle'])
 
 
+class NumpyEngineTests(object):
+    """Mixin to link DataFrames with the array-based linker."""
+    def link(self, *args, **kwargs):
+        raise nose.SkipTest("The 'numpy' engine links DataFrames only.")
+
+    def link_df(self, *args, **kwargs):
+        kwargs['engine'] = 'numpy'
+        return super(NumpyEngineTests, self).link_df(*args, **kwargs)
+
+    def link_df_iter(self, *args, **kwargs):
+        kwargs['engine'] = 'numpy'
+        return super(NumpyEngineTests, self).link_df_iter(*args, **kwargs)
+
+
 class NumbaOnlyTests(SubnetNeededTests):
     """Tests that are unbearably slow without a fast subnet linker."""
     def test_adaptive_range(self):
@@ -720,6 +896,45 @@ class TestBTreeWithNumbaLink(NumbaOnlyTests, unittest.TestCase):
         self.linker_opts = dict(link_strategy='numba',
                                 neighbor_strategy='BTree')
 
+
+class TestKDTreeWithHungarianLink(SubnetNeededTests, unittest.TestCase):
+    def setUp(self):
+        _skip_if_no_linear_sum_assignment()
+        self.linker_opts = dict(link_strategy='hungarian',
+                                neighbor_strategy='KDTree')
+
+    def test_oversize_fail(self):
+        """There is no limit on the size of subnets."""
+        tracks = self.link_df(contracting_grid(), 1)
+        assert len(tracks) == len(contracting_grid())
+
+    def test_adaptive_fail(self):
+        """There is no limit on the size of subnets."""
+        self.link_df(contracting_grid(), 1, adaptive_stop=0.92)
+
+
+class TestNumpyEngineWithDropLink(NumpyEngineTests, TestKDTreeWithDropLink):
+    pass
+
+
+class TestNumpyEngineWithRecursiveLink(NumpyEngineTests,
+                                       TestKDTreeWithRecursiveLink):
+    pass
+
+
+class TestNumpyEngineWithNonrecursiveLink(NumpyEngineTests,
+                                          TestKDTreeWithNonrecursiveLink):
+    pass
+
+
+class TestNumpyEngineWithNumbaLink(NumpyEngineTests, TestKDTreeWithNumbaLink):
+    pass
+
+
+class TestNumpyEngineWithHungarianLink(NumpyEngineTests,
+                                       TestKDTreeWithHungarianLink):
+    pass
+
 if __name__ == '__main__':
     import nose
     nose.runmodule(argv=[__file__, '-vvs', '-x', '--pdb', '--pdb-failure'],
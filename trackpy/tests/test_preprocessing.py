@@ -0,0 +1,140 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import six
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.ndimage import fourier_gaussian, uniform_filter1d
+
+from trackpy import preprocessing
+from trackpy.artificial import draw_spots, gen_nonoverlapping_locations
+from trackpy.preprocessing import (bandpass, scale_to_gamut,
+                                   set_fft_backend, gaussian_method)
+
+
+def reference_bandpass(image, lshort, llong, threshold):
+    """Bandpass with complex FFTs, the way it used to be done."""
+    boxcar = image
+    for axis in range(image.ndim):
+        boxcar = uniform_filter1d(boxcar, 2*llong + 1, axis, mode='nearest')
+    transformed = fourier_gaussian(np.fft.fftn(image), lshort)
+    result = np.fft.ifftn(transformed).real - boxcar
+    return np.where(result > threshold, result, 0)
+
+
+class TestFFTBackends(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.image = np.random.rand(60, 71)*100
+
+    def tearDown(self):
+        set_fft_backend()
+
+    def test_same_as_complex_fft(self):
+        expected = reference_bandpass(self.image, 1, 5, 1)
+        for backend in preprocessing.FFT_BACKENDS:
+            for workers in [1, 2]:
+                set_fft_backend(backend, workers)
+                actual = bandpass(self.image, 1, 5, 1, method='fourier')
+                self.assertEqual(actual.dtype, np.float64)
+                assert_allclose(actual, expected, atol=1e-10)
+
+    def test_single_precision(self):
+        image = self.image.astype(np.float32)
+        expected = reference_bandpass(self.image, 1, 5, 1)
+        for backend in preprocessing.FFT_BACKENDS:
+            set_fft_backend(backend)
+            actual = bandpass(image, 1, 5, 1, method='fourier')
+            self.assertEqual(actual.dtype, np.float32)
+            assert_allclose(actual, expected, atol=1e-3)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, set_fft_backend, 'fftpack')
+
+
+class TestGaussianMethod(unittest.TestCase):
+
+    def test_real_same_as_fourier(self):
+        np.random.seed(0)
+        for shape, lshort in [((100, 110), 1), ((100, 110), (1.5, 1)),
+                              ((30, 40, 50), 1)]:
+            pos = gen_nonoverlapping_locations(shape, 5, 10, 10)
+            image = draw_spots(shape, pos, 7, noise_level=10)
+            # With a threshold of 0, no values jump across the threshold.
+            expected = bandpass(image, lshort, 7, 0, method='fourier')
+            actual = bandpass(image, lshort, 7, 0, method='real')
+            # The Fourier method wraps around at the edges; compare inside.
+            inside = tuple([slice(10, -10)]*len(shape))
+            assert_allclose(actual[inside], expected[inside], atol=0.1)
+
+    def test_choice(self):
+        self.assertEqual(gaussian_method((1024, 1024), (1, 1)), 'real')
+        self.assertEqual(gaussian_method((1024, 1024), (10, 10)), 'fourier')
+
+    def test_unknown_method(self):
+        image = np.zeros((10, 10))
+        self.assertRaises(ValueError, bandpass, image, 1, 5, method='fast')
+
+
+class TestStack(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = preprocessing.STACK_CHUNK_SIZE
+
+    def tearDown(self):
+        preprocessing.STACK_CHUNK_SIZE = self.chunk_size
+
+    def test_same_as_framewise(self):
+        np.random.seed(0)
+        stack = np.random.randint(0, 200, (7, 50, 60)).astype(np.uint8)
+        for method in ['real', 'fourier']:
+            expected = [bandpass(frame, 1, 5, method=method)
+                        for frame in stack]
+            actual = bandpass(stack, 1, 5, method=method, stack=True)
+            assert_allclose(actual, expected)
+            # Force chunking.
+            preprocessing.STACK_CHUNK_SIZE = 2*50*60
+            actual = bandpass(stack, 1, 5, method=method, stack=True)
+            assert_allclose(actual, expected)
+            preprocessing.STACK_CHUNK_SIZE = self.chunk_size
+
+
+class TestPrecision(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        shape = (100, 110)
+        pos = gen_nonoverlapping_locations(shape, 5, 10, 10)
+        self.image = draw_spots(shape, pos, 7,
+                                noise_level=1000).astype(np.uint16)
+
+    def test_bandpass(self):
+        for method in ['real', 'fourier']:
+            expected = bandpass(self.image, 1, 5, method=method)
+            self.assertEqual(expected.dtype, np.float64)
+            actual = bandpass(self.image, 1, 5, method=method,
+                              dtype=np.float32)
+            self.assertEqual(actual.dtype, np.float32)
+            assert_allclose(actual, expected, rtol=1e-4, atol=1e-2)
+
+    def test_scale_to_gamut(self):
+        image = bandpass(self.image, 1, 5, dtype=np.float32)
+        expected = scale_to_gamut(image.astype(np.float64), np.uint16)
+        actual = scale_to_gamut(image, np.uint16)
+        self.assertEqual(actual.dtype, np.uint16)
+        assert_allclose(actual, expected, atol=1)
+        # Scaling in place gives the same result.
+        assert_allclose(scale_to_gamut(image, np.uint16,
+                                       overwrite_input=True), actual)
+
+    def test_unsupported_dtype(self):
+        self.assertRaises(ValueError, bandpass, self.image, 1, 5,
+                          dtype=np.int32)
+
+
+if __name__ == '__main__':
+    import nose
+    nose.runmodule(argv=[__file__, '-vvs', '-x', '--pdb', '--pdb-failure'],
+                   exit=False)
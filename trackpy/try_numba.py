@@ -24,6 +24,7 @@ ENABLE_NUMBA_ON_IMPORT = True
 _registered_functions = list()  # functions that can be numba-compiled
 
 NUMBA_AVAILABLE = False
+NUMBA_NOGIL = False  # whether compiled functions can release the GIL
 
 try:
     import numba
@@ -42,6 +43,7 @@ else:
         warn(message)
     else:
         NUMBA_AVAILABLE = True
+        NUMBA_NOGIL = (int(major), int(minor)) >= (0, 20)
         _hush_llvm()
 
 
@@ -86,10 +88,14 @@ def try_numba_autojit(func=None, **kw):
     """Wrapper for numba.autojit() that treats the function as pure Python if numba is missing.
 
     Usage is as with autojit(): Either as a bare decorator (no parentheses), or with keyword
-    arguments.
+    arguments. The nogil keyword is dropped for numba versions that do not
+    support it.
 
     The resulting compiled numba function can subsequently be turned on or off with
     enable_numba() and disable_numba(). It will be on by default."""
+    if not NUMBA_NOGIL:
+        kw.pop('nogil', None)
+
     def return_decorator(func):
         # Register the function with a global list of numba-enabled functions.
         f = RegisteredFunction(func, autojit_kw=kw)
@@ -9,7 +9,7 @@ from .masks import binary_mask
 from .utils import validate_tuple
 
 
-def roi(image, diameter, threshold=None):
+def roi(image, diameter, threshold=None, image_bandpassed=None):
     """Return a mask selecting the neighborhoods of bright regions.
     See Biophysical journal 88(1) 623-638 Figure C.
 
@@ -17,23 +17,34 @@ def roi(image, diameter, threshold=None):
     ----------
     image : ndarray
     diameter : feature size used for centroid identification
+    threshold : passed through to bandpass
+    image_bandpassed : ndarray, optional
+        The image after bandpass, for example as computed by locate. Its
+        nonzero pixels are taken as the bright regions. If None (default),
+        the image is bandpassed here.
 
     Returns
     -------
     boolean ndarray, True around bright regions
     """
     diameter = validate_tuple(diameter, image.ndim)
-    signal_mask = bandpass(image, 1, tuple([d + 1 for d in diameter]), threshold)
+    if image_bandpassed is None:
+        image_bandpassed = bandpass(image, 1, tuple([d + 1 for d in diameter]),
+                                    threshold)
     radius = tuple([int(d)//2 for d in diameter])
     structure = binary_mask(radius, image.ndim)
-    signal_mask = morphology.binary_dilation(signal_mask, structure=structure)
+    signal_mask = morphology.binary_dilation(image_bandpassed,
+                                             structure=structure)
     return signal_mask
 
 
-def measure_noise(image, diameter, threshold):
-    "Compute the standard deviation of the dark pixels outside the signal."
-    signal_mask = roi(image, diameter, threshold)
-    return image[~signal_mask].mean(), image[~signal_mask].std()
+def measure_noise(image, diameter, threshold, image_bandpassed=None):
+    """Compute the mean and standard deviation of the dark pixels outside the
+    signal. If given, image_bandpassed is used to find the signal; see roi.
+    """
+    signal_mask = roi(image, diameter, threshold, image_bandpassed)
+    background = image[~signal_mask]
+    return background.mean(), background.std()
 
 
 def static_error(features, noise, diameter, noise_size=1):
@@ -63,8 +74,14 @@ def static_error(features, noise, diameter, noise_size=1):
     else:
         noise.name = 'noise'
         N_S = features.join(noise, on='frame')['noise']/features['signal']
-    s = 2*((diameter//2-1)/features['size'])**2
-    ep = N_S*noise_size/(2*np.pi**0.5)*s/(1-np.exp(-s))
-    # ^ Savin & Doyle, Eq. 50
+    ep = _static_error(N_S, features['size'], diameter, noise_size)
     ep.name = 'ep'  # so it can be joined
     return ep
+
+
+def _static_error(noise_to_signal, size, diameter, noise_size):
+    """Compute the static error from arrays (or Series) of the noise-to-signal
+    ratio and size. See static_error."""
+    s = 2*((diameter//2-1)/size)**2
+    return noise_to_signal*noise_size/(2*np.pi**0.5)*s/(1-np.exp(-s))
+    # ^ Savin & Doyle, Eq. 50